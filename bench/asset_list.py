@@ -0,0 +1,146 @@
+"""Measure serializing and compressing a full /assets listing.
+
+Seeds a library (default 100k assets, 3 tags each) and compares, for the
+unpaged list:
+
+* dicts+json     - asset_to_dict rows through jsonable_encoder and json.dumps
+                   (what FastAPI did for the old list_assets)
+* dicts+orjson   - the same dicts through orjson, when it is installed
+* sqlite json    - the current list_assets path: json_object() rows joined
+* grid columns   - columnar=true with the fields the web grid requests
+
+and then the size and CPU cost of each available Content-Encoding.
+
+    python bench/asset_list.py [--assets 100000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def seed(db_path: Path, count: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO tags(name) VALUES (?)", [(f"tag{i}",) for i in range(200)])
+    conn.executemany(
+        """
+        INSERT INTO assets(filename, stored_name, thumb_small_name, thumb_medium_name, media_type, mime,
+                           format, size_bytes, width, height, colors, content_hash, created_at)
+        VALUES (?, ?, ?, ?, 'image', 'image/jpeg', 'jpg', 1048576, 4000, 3000, ?, ?, ?)
+        """,
+        [
+            (
+                f"IMG_{i:06d}.jpg",
+                f"blobs/{i % 256:02x}/{i % 251:02x}/{i:064x}.jpg",
+                f"blobs/{i % 256:02x}/{i % 251:02x}/{i:064x}.small.webp",
+                f"blobs/{i % 256:02x}/{i % 251:02x}/{i:064x}.medium.webp",
+                json.dumps(["#a1b2c3", "#112233", "#ffeedd", "#000000", "#7f7f7f"]),
+                f"{i:064x}",
+                f"2024-01-01T00:00:{i:010d}",
+            )
+            for i in range(count)
+        ],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO asset_tags(asset_id, tag_id) VALUES (?, ?)",
+        [(i + 1, random.randint(1, 200)) for i in range(count) for _ in range(3)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def timed(repeat: int, func):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func()
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CEAGLE_DATA_DIR"] = str(Path(tmp) / "data")
+        os.environ["CEAGLE_STORAGE_DIR"] = str(Path(tmp) / "storage")
+        from fastapi.encoders import jsonable_encoder
+        from starlette.requests import Request
+
+        from server import app as server_app
+        from server.config import DB_PATH
+        from server.db import close_pool, fetch_all, init_db
+        from server.responses import COMPRESSORS
+
+        init_db()
+        seed(DB_PATH, args.assets)
+
+        def old_path() -> bytes:
+            rows = fetch_all("SELECT * FROM assets ORDER BY created_at DESC, id DESC")
+            tags_map = server_app.get_tags_for_assets([row["id"] for row in rows])
+            content = jsonable_encoder([server_app.asset_to_dict(row, tags_map) for row in rows])
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode(
+                "utf-8"
+            )
+
+        def orjson_path() -> bytes:
+            rows = fetch_all("SELECT * FROM assets ORDER BY created_at DESC, id DESC")
+            tags_map = server_app.get_tags_for_assets([row["id"] for row in rows])
+            return orjson.dumps([server_app.asset_to_dict(row, tags_map) for row in rows])
+
+        request = Request({"type": "http", "method": "GET", "headers": [], "query_string": b""})
+
+        def new_path() -> bytes:
+            return server_app.list_assets(request).body
+
+        grid_fields = (
+            "id,filename,media_type,format,width,height,size_bytes,tags,colors,status,note,folder_id,"
+            "url,preview_url,thumb_url,thumb_medium_url"
+        )
+
+        def columnar_path() -> bytes:
+            return server_app.list_assets(request, fields=grid_fields, columnar=True).body
+
+        print(f"{args.assets} assets, unpaged GET /assets (best of {args.repeat}, process CPU)")
+        candidates = [("dicts+json", old_path)]
+        try:
+            import orjson
+
+            candidates.append(("dicts+orjson", orjson_path))
+        except ImportError:
+            pass
+        candidates.append(("sqlite json", new_path))
+        candidates.append(("grid columns", columnar_path))
+        bodies = {}
+        for label, func in candidates:
+            cpu, bodies[label] = timed(args.repeat, func)
+            print(f"{label:>14}: {cpu * 1000:8.1f} ms  {len(bodies[label]) / 1024 ** 2:7.2f} MiB")
+
+        for label in ("sqlite json", "grid columns"):
+            body = bodies[label]
+            print(f"compression of the {label} body:")
+            for name, compress in COMPRESSORS.items():
+                cpu, packed = timed(args.repeat, lambda: compress(body))
+                print(
+                    f"{name:>14}: {cpu * 1000:8.1f} ms  {len(packed) / 1024 ** 2:7.2f} MiB"
+                    f"  ({len(body) / len(packed):4.1f}x)"
+                )
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
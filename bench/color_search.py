@@ -0,0 +1,110 @@
+"""Compare the old per-row color_match UDF with the asset_colors rtree filter.
+
+Seeds a library (default 500k assets, 5 random palette colors each) and times
+the id query behind GET /assets?color=... for a few query colors:
+
+* udf    - the old path: a Python function decoding every asset's colors JSON
+           and comparing RGB distance (threshold 60)
+* rtree  - build_asset_filters with the Lab index (threshold in Delta E)
+
+    python bench/color_search.py [--assets 500000] [--queries 5]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def old_color_match(colors_json, targets, threshold):
+    colors = json.loads(colors_json) if colors_json else []
+    for target in targets.split(","):
+        t = tuple(int(target.lstrip("#")[i : i + 2], 16) for i in (0, 2, 4))
+        for value in colors:
+            c = tuple(int(value.lstrip("#")[i : i + 2], 16) for i in (0, 2, 4))
+            if sum((x - y) ** 2 for x, y in zip(c, t)) ** 0.5 <= threshold:
+                return 1
+    return 0
+
+
+def seed(db_path: Path, count: int, rng: random.Random) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute("BEGIN")
+    conn.executemany(
+        """
+        INSERT INTO assets(filename, stored_name, media_type, format, size_bytes, colors, created_at)
+        VALUES (?, ?, 'image', 'jpg', 1048576, ?, ?)
+        """,
+        [
+            (
+                f"IMG_{i:06d}.jpg",
+                f"{i}.jpg",
+                json.dumps(["#%06x" % rng.randrange(0x1000000) for _ in range(5)]),
+                f"2024-01-01T00:00:{i:010d}",
+            )
+            for i in range(count)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CEAGLE_DATA_DIR"] = str(Path(tmp) / "data")
+        os.environ["CEAGLE_STORAGE_DIR"] = str(Path(tmp) / "storage")
+        from server.config import DB_PATH
+        from server.db import close_pool, connect, init_db
+
+        init_db()
+        seed(DB_PATH, args.assets, rng)
+        started = time.perf_counter()
+        conn = connect()
+        conn.execute("DROP TABLE asset_colors")
+        conn.close()
+        init_db()
+        print(f"{args.assets} assets, index built in {time.perf_counter() - started:.1f} s")
+
+        from server.app import build_asset_filters
+
+        conn = connect()
+        conn.create_function("color_match", 3, old_color_match, deterministic=True)
+        targets = ["#%06x" % rng.randrange(0x1000000) for _ in range(args.queries)]
+        for target in targets:
+            started = time.perf_counter()
+            old = conn.execute(
+                "SELECT COUNT(*) FROM assets WHERE color_match(assets.colors, ?, ?)", (target, 60.0)
+            ).fetchone()[0]
+            old_ms = (time.perf_counter() - started) * 1000
+            sql, params = build_asset_filters(color=target)
+            started = time.perf_counter()
+            new = conn.execute(f"SELECT COUNT(*) FROM assets WHERE {sql}", params).fetchone()[0]
+            new_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            conn.execute(
+                f"SELECT id FROM assets WHERE {sql} ORDER BY created_at DESC, id DESC LIMIT 200", params
+            ).fetchall()
+            page_ms = (time.perf_counter() - started) * 1000
+            print(
+                f"{target}: udf {old_ms:8.1f} ms ({old:6d})  rtree {new_ms:7.1f} ms ({new:6d})"
+                f"  first page {page_ms:6.1f} ms"
+            )
+        conn.close()
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Compare per-call SQLite connections against the pooled WAL layer in server/db.py.
+
+Simulates concurrent /assets page reads (page + tags + count) mixed with tag
+writes, first with a fresh rollback-journal connection per statement (the old
+behaviour) and then through server.db's pool.
+
+    python bench/db_pool.py [--assets 50000] [--threads 16] [--requests 2000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def seed(db_path: Path, count: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO tags(name) VALUES (?)",
+        [(f"tag{i}",) for i in range(200)],
+    )
+    conn.executemany(
+        """
+        INSERT INTO assets(filename, stored_name, media_type, mime, format, size_bytes, width, height, colors, created_at)
+        VALUES (?, ?, 'image', 'image/jpeg', 'jpg', 1024, 800, 600, '[]', ?)
+        """,
+        [(f"file{i}.jpg", f"{i}.jpg", f"2024-01-01T00:00:{i:010d}") for i in range(count)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO asset_tags(asset_id, tag_id) VALUES (?, ?)",
+        [(i + 1, random.randint(1, 200)) for i in range(count) for _ in range(3)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def per_call_ops(db_path: Path):
+    def run(query, params=(), write=False):
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        cur = conn.execute(query, params)
+        rows = cur.fetchall()
+        if write:
+            conn.commit()
+        conn.close()
+        return rows
+
+    return run
+
+
+def pooled_ops():
+    from server import db
+
+    def run(query, params=(), write=False):
+        if write:
+            return db.execute(query, params)
+        return db.fetch_all(query, params)
+
+    return run
+
+
+def request(run, count: int) -> float:
+    started = time.perf_counter()
+    if random.random() < 0.1:
+        asset_id = random.randint(1, count)
+        tag_id = random.randint(1, 200)
+        run("DELETE FROM asset_tags WHERE asset_id = ? AND tag_id = ?", (asset_id, tag_id), write=True)
+        run("INSERT OR IGNORE INTO asset_tags(asset_id, tag_id) VALUES (?, ?)", (asset_id, tag_id), write=True)
+    else:
+        rows = run("SELECT * FROM assets ORDER BY created_at DESC, id DESC LIMIT 200")
+        ids = [row["id"] for row in rows]
+        run(
+            f"""
+            SELECT asset_tags.asset_id, tags.name FROM asset_tags
+            JOIN tags ON tags.id = asset_tags.tag_id
+            WHERE asset_tags.asset_id IN ({','.join('?' for _ in ids)})
+            """,
+            ids,
+        )
+        run("SELECT COUNT(*) FROM folders")
+    return (time.perf_counter() - started) * 1000
+
+
+def measure(label: str, run, args) -> None:
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        started = time.perf_counter()
+        latencies = list(pool.map(lambda _: request(run, args.assets), range(args.requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:>10}: {args.requests / elapsed:8.1f} req/s  "
+        f"p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=50000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CEAGLE_DATA_DIR"] = str(Path(tmp) / "pooled")
+        os.environ["CEAGLE_STORAGE_DIR"] = str(Path(tmp) / "storage")
+        from server import db
+
+        db.init_db()
+        seed(db.DB_PATH, args.assets)
+
+        baseline_path = Path(tmp) / "baseline.db"
+        source = sqlite3.connect(db.DB_PATH)
+        target = sqlite3.connect(baseline_path)
+        source.backup(target)
+        target.execute("PRAGMA journal_mode = DELETE")
+        source.close()
+        target.close()
+
+        print(f"{args.assets} assets, {args.threads} threads, {args.requests} requests (10% writes)")
+        measure("per-call", per_call_ops(baseline_path), args)
+        measure("pooled", pooled_ops(), args)
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compare the old getcolors top-5 palette with utils.extract_palette.
+
+Renders photo-like test images (smooth gradients, a few solid regions and
+sensor-style noise) and reports, per image size:
+
+* time per image for the old extractor, extract_palette with NumPy and
+  extract_palette's median-cut-only fallback
+* how distinct the returned colors are: the smallest CIE76 distance between
+  any two of them (near 0 means the palette repeats the same color)
+
+    python bench/palette_extraction.py [--images 20] [--sizes 640,2000,4000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from server import utils  # noqa: E402
+from server.colors import hex_to_lab  # noqa: E402
+
+
+def old_extract_colors(img: Image.Image, max_colors: int = 5):
+    small = img.copy()
+    small.thumbnail((64, 64))
+    colors = small.getcolors(64 * 64)
+    if not colors:
+        return []
+    colors.sort(key=lambda item: item[0], reverse=True)
+    return [utils.rgb_to_hex(color[1]) for color in colors[:max_colors]]
+
+
+def photo(size: int, rng: random.Random) -> Image.Image:
+    width, height = size, size * 3 // 4
+    top = tuple(rng.randrange(256) for _ in range(3))
+    bottom = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.linear_gradient("L").resize((width, height))
+    img = Image.composite(Image.new("RGB", (width, height), top), Image.new("RGB", (width, height), bottom), img)
+    draw = ImageDraw.Draw(img)
+    for _ in range(4):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(size // 10, size // 3)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    img = img.filter(ImageFilter.GaussianBlur(size / 200))
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    return Image.blend(img, noise, 0.08)
+
+
+def min_distance(colors) -> float:
+    labs = [hex_to_lab(color) for color in colors]
+    distances = [
+        sum((x - y) ** 2 for x, y in zip(labs[i], labs[j])) ** 0.5
+        for i in range(len(labs))
+        for j in range(i + 1, len(labs))
+    ]
+    return min(distances) if distances else float("nan")
+
+
+def fallback_palette(img: Image.Image):
+    np, utils.np = utils.np, None
+    try:
+        return utils.extract_palette(img)
+    finally:
+        utils.np = np
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--sizes", default="640,2000,4000")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    candidates = [("getcolors top-5", old_extract_colors)]
+    if utils.np is not None:
+        candidates.append(("median cut + Lab k-means", lambda img: [c for c, _ in utils.extract_palette(img)]))
+    candidates.append(("median cut only", lambda img: [c for c, _ in fallback_palette(img)]))
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        images = [photo(size, rng) for _ in range(args.images)]
+        print(f"{args.images} images at {size}x{size * 3 // 4}")
+        for label, func in candidates:
+            started = time.process_time()
+            palettes = [func(img) for img in images]
+            per_image = (time.process_time() - started) / len(images) * 1000
+            spread = sorted(min_distance(palette) for palette in palettes)
+            colors = sum(len(palette) for palette in palettes) / len(palettes)
+            print(
+                f"  {label:>25}: {per_image:7.2f} ms/image  {colors:3.1f} colors"
+                f"  median min Delta E {spread[len(spread) // 2]:5.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
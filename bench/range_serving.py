@@ -0,0 +1,123 @@
+"""Compare the old generator-based /media Range path with RangeFileResponse.
+
+Each response is pushed through a socketpair drained by a background thread,
+so the numbers include the real cost of getting bytes into a socket:
+
+* generator  - StreamingResponse over a 1 MiB read() generator (the old path)
+* pread      - RangeFileResponse (pread chunks from a worker thread)
+
+CPU is process time (both threads) per GiB delivered.
+
+    python bench/range_serving.py [--size-mb 512] [--full 4] [--seeks 400] [--seek-kb 4096]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from starlette.responses import StreamingResponse
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from server.responses import RangeFileResponse  # noqa: E402
+
+
+def iter_file_range(file_path, start: int, end: int, chunk_size: int = 1024 * 1024):
+    with file_path.open("rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = handle.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def drain(sock: socket.socket) -> None:
+    buffer = bytearray(4 * 1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+
+def make_send(sock: socket.socket):
+    async def send(message) -> None:
+        kind = message["type"]
+        if kind == "http.response.start":
+            sock.sendall(b"HTTP/1.1 %d\r\n\r\n" % message["status"])
+        elif kind == "http.response.body":
+            if message.get("body"):
+                sock.sendall(message["body"])
+
+    return send
+
+
+async def receive():
+    await asyncio.Event().wait()
+
+
+def build(mode: str, path: Path, size: int, start: int, end: int):
+    if mode == "generator":
+        return StreamingResponse(iter_file_range(path, start, end), status_code=206)
+    return RangeFileResponse(path, {"range": f"bytes={start}-{end}"})
+
+
+async def run(mode: str, path: Path, size: int, requests) -> int:
+    ours, theirs = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(theirs,), daemon=True)
+    reader.start()
+    send = make_send(ours)
+    scope = {"type": "http", "method": "GET", "extensions": {}}
+    total = 0
+    for start, end in requests:
+        await build(mode, path, size, start, end)(scope, receive, send)
+        total += end - start + 1
+    ours.shutdown(socket.SHUT_WR)
+    reader.join()
+    ours.close()
+    theirs.close()
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--full", type=int, default=4, help="whole-file requests")
+    parser.add_argument("--seeks", type=int, default=400, help="random range requests (video scrubbing)")
+    parser.add_argument("--seek-kb", type=int, default=4096)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    seek = args.seek_kb * 1024
+    rng = random.Random(0)
+    requests = [(0, size - 1)] * args.full
+    for _ in range(args.seeks):
+        start = rng.randrange(0, size - seek)
+        requests.append((start, start + seek - 1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "media.bin"
+        with path.open("wb") as handle:
+            for _ in range(args.size_mb):
+                handle.write(os.urandom(1024 * 1024))
+        print(f"{args.size_mb} MiB file, {args.full} full + {args.seeks} x {args.seek_kb} KiB ranges")
+        for mode in ("generator", "pread"):
+            asyncio.run(run(mode, path, size, requests[:2]))  # warm the page cache
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            total = asyncio.run(run(mode, path, size, requests))
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            gib = total / 1024 ** 3
+            print(f"{mode:>10}: {total / wall / 1024 ** 2:9.1f} MiB/s  {cpu / gib:6.3f} CPU s/GiB")
+
+
+if __name__ == "__main__":
+    main()
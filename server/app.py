@@ -1,28 +1,66 @@
 ﻿from __future__ import annotations
 
+import base64
 import json
-import shutil
+import threading
 from pathlib import Path
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from uuid import uuid4
 
 from fastapi import Body, FastAPI, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from .config import STORAGE_DIR
-from .db import execute, execute_many, fetch_all, fetch_one, from_json, init_db, to_json
+from .config import (
+    DEDUP_POLICY,
+    JOB_STALE_SECONDS,
+    MAX_UPLOAD_BYTES,
+    RESUMABLE_CHUNK_SIZE,
+    STORAGE_DIR,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_STAGING_DIR,
+)
+from .blobs import blob_name, release_blobs, staging_target, store_blob
+from .colors import DEFAULT_DELTA_E, color_bucket, color_filter, palette_rows, slot_ids
+from .db import (
+    annotation_text,
+    close_pool,
+    execute,
+    execute_many,
+    fetch_all,
+    fetch_one,
+    from_json,
+    init_db,
+    now_iso,
+    to_json,
+    transaction,
+)
+from .jobs import (
+    PROCESS_ID,
+    enqueue_job,
+    job_counts,
+    register_handler,
+    register_heartbeat,
+    run_in_process,
+    start_workers,
+    stop_workers,
+)
+from .responses import IMMUTABLE, REVALIDATE, RangeFileResponse, content_disposition, encoded_response
+from .storage_gc import GCBusy, gc_status, run_gc
 from .utils import (
+    THUMB_SIZES,
+    UploadTooLarge,
+    copy_and_hash,
     detect_media_type,
     file_extension,
-    ffmpeg_thumbnail,
-    ffprobe_metadata,
-    image_metadata,
+    hash_file,
     is_raw_extension,
-    raw_preview,
+    render_derivatives,
     sniff_mime,
+    write_at,
+    write_raw_preview,
 )
 
 app = FastAPI(title="Meagle")
@@ -45,92 +83,47 @@ async def api_prefix_middleware(request: Request, call_next):
         request.scope["path"] = request.scope["path"][4:] or "/"
     return await call_next(request)
 
-def iter_file_range(file_path, start: int, end: int, chunk_size: int = 1024 * 1024):
-    with file_path.open("rb") as handle:
-        handle.seek(start)
-        remaining = end - start + 1
-        while remaining > 0:
-            read_size = min(chunk_size, remaining)
-            data = handle.read(read_size)
-            if not data:
-                break
-            remaining -= len(data)
-            yield data
 
+@app.middleware("http")
+async def upload_size_guard(request: Request, call_next):
+    # Reject oversized bodies before Starlette spools them to disk; the copy in
+    # upload_asset still enforces the limit for chunked requests.
+    length = request.headers.get("content-length")
+    if MAX_UPLOAD_BYTES and request.method in {"POST", "PUT"} and length and length.isdigit():
+        if int(length) > MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE:
+            return JSONResponse({"detail": "file too large"}, status_code=413)
+    return await call_next(request)
 
-@app.head("/media/{file_path:path}")
-def media_head(file_path: str):
-    safe_path = sanitize_path(file_path)
-    target = STORAGE_DIR / safe_path
-    if not target.exists() or not target.is_file():
-        raise HTTPException(404, "file missing")
-    file_size = target.stat().st_size
-    media_type = sniff_mime(target.name) or "application/octet-stream"
-    return Response(
-        status_code=200,
-        headers={
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-            "Content-Type": media_type,
-        },
-    )
 
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+DEDUP_POLICIES = {"reject", "link", "share"}
+PROCESSED_MEDIA_TYPES = {"image", "gif", "raw", "video"}
 
-@app.get("/media/{file_path:path}")
-def media_stream(file_path: str, request: Request):
-    safe_path = sanitize_path(file_path)
-    target = STORAGE_DIR / safe_path
-    if not target.exists() or not target.is_file():
+
+def media_target(file_path: str) -> Path:
+    target = STORAGE_DIR / sanitize_path(file_path)
+    if target.parent == UPLOAD_STAGING_DIR or not target.exists() or not target.is_file():
         raise HTTPException(404, "file missing")
+    return target
 
-    file_size = target.stat().st_size
-    media_type = sniff_mime(target.name) or "application/octet-stream"
-    range_header = request.headers.get("range")
-    headers = {
-        "Accept-Ranges": "bytes",
-        "Content-Type": media_type,
-        "Content-Length": str(file_size),
-    }
 
-    if not range_header:
-        return FileResponse(target, media_type=media_type, headers=headers)
+@app.head("/media/{file_path:path}")
+def media_head(file_path: str, request: Request):
+    return media_stream(file_path, request)
 
-    try:
-        unit, value = range_header.split("=", 1)
-        if unit.strip().lower() != "bytes":
-            raise ValueError("invalid range unit")
-        start_str, end_str = value.split("-", 1)
-        if start_str == "":
-            length = int(end_str)
-            start = max(file_size - length, 0)
-            end = file_size - 1
-        else:
-            start = int(start_str)
-            end = int(end_str) if end_str else file_size - 1
-        if start < 0 or end < start or start >= file_size:
-            raise ValueError("invalid range")
-        end = min(end, file_size - 1)
-    except Exception:
-        return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
 
-    headers.update(
-        {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Content-Length": str(end - start + 1),
-        }
-    )
-    return StreamingResponse(
-        iter_file_range(target, start, end),
-        status_code=206,
-        media_type=media_type,
-        headers=headers,
+@app.get("/media/{file_path:path}")
+def media_stream(file_path: str, request: Request):
+    target = media_target(file_path)
+    return RangeFileResponse(
+        target,
+        request.headers,
+        media_type=sniff_mime(target.name) or "application/octet-stream",
+        cache_control=IMMUTABLE,
     )
 
 
-def now_iso() -> str:
-    return datetime.utcnow().isoformat()
-
-
 def normalize_tags(tags: Optional[str]) -> List[str]:
     if not tags:
         return []
@@ -148,30 +141,39 @@ def normalize_annotations(value: Optional[str]) -> List[str]:
 def ensure_tags(tag_names: List[str]) -> Dict[str, int]:
     if not tag_names:
         return {}
-    existing = fetch_all(
-        f"SELECT id, name FROM tags WHERE name IN ({','.join('?' for _ in tag_names)})",
-        tag_names,
-    )
-    tag_map = {row["name"]: row["id"] for row in existing}
-    missing = [t for t in tag_names if t not in tag_map]
-    for name in missing:
-        tag_id = execute("INSERT INTO tags(name) VALUES (?)", (name,))
-        tag_map[name] = tag_id
-    return tag_map
+    with transaction():
+        execute_many("INSERT OR IGNORE INTO tags(name) VALUES (?)", [(name,) for name in tag_names])
+        rows = fetch_all(
+            f"SELECT id, name FROM tags WHERE name IN ({','.join('?' for _ in tag_names)})",
+            tag_names,
+        )
+    return {row["name"]: row["id"] for row in rows}
 
 
 def set_asset_tags(asset_id: int, tag_names: List[str]) -> List[str]:
     if tag_names is None:
         return []
     tag_names = sorted(set(tag_names))
-    tag_map = ensure_tags(tag_names)
-    execute("DELETE FROM asset_tags WHERE asset_id = ?", (asset_id,))
-    if tag_map:
+    with transaction():
+        tag_map = ensure_tags(tag_names)
+        execute("DELETE FROM asset_tags WHERE asset_id = ?", (asset_id,))
+        if tag_map:
+            execute_many(
+                "INSERT INTO asset_tags(asset_id, tag_id) VALUES (?, ?)",
+                [(asset_id, tag_map[name]) for name in tag_names],
+            )
+    return tag_names
+
+
+def add_asset_tags(asset_id: int, tag_names: List[str]) -> None:
+    if not tag_names:
+        return
+    with transaction():
+        tag_map = ensure_tags(sorted(set(tag_names)))
         execute_many(
-            "INSERT INTO asset_tags(asset_id, tag_id) VALUES (?, ?)",
-            [(asset_id, tag_map[name]) for name in tag_names],
+            "INSERT OR IGNORE INTO asset_tags(asset_id, tag_id) VALUES (?, ?)",
+            [(asset_id, tag_id) for tag_id in tag_map.values()],
         )
-    return tag_names
 
 
 def get_tags_for_assets(asset_ids: List[int]) -> Dict[int, List[str]]:
@@ -192,40 +194,10 @@ def get_tags_for_assets(asset_ids: List[int]) -> Dict[int, List[str]]:
     return result
 
 
-def get_annotations_for_assets(asset_ids: List[int]) -> Dict[int, List[str]]:
-    if not asset_ids:
-        return {}
-    rows = fetch_all(
-        f"""
-        SELECT asset_id, data_json
-        FROM annotations
-        WHERE asset_id IN ({','.join('?' for _ in asset_ids)})
-        """,
-        asset_ids,
-    )
-    result: Dict[int, List[str]] = {asset_id: [] for asset_id in asset_ids}
-    for row in rows:
-        data = from_json(row["data_json"]) or {}
-        text = str(data.get("text") or "").strip()
-        if text:
-            result[row["asset_id"]].append(text)
-    return result
-
-
 @app.get("/annotations")
 def list_annotations():
-    rows = fetch_all("SELECT data_json FROM annotations")
-    counts: Dict[str, int] = {}
-    for row in rows:
-        data = from_json(row["data_json"]) or {}
-        text = str(data.get("text") or "").strip()
-        if not text:
-            continue
-        key = text.lower()
-        counts[key] = counts.get(key, 0) + 1
-    result = [{"text": text, "count": count} for text, count in counts.items()]
-    result.sort(key=lambda item: item["count"], reverse=True)
-    return result
+    rows = fetch_all("SELECT text, count FROM annotation_counts ORDER BY count DESC, text")
+    return [dict(row) for row in rows]
 
 
 def auto_tags(media_type: str, ext: str, width: Optional[int], height: Optional[int]) -> List[str]:
@@ -262,13 +234,90 @@ def asset_to_dict(row, tags_map: Dict[int, List[str]]) -> Dict:
         "folder_id": row["folder_id"],
         "note": row["note"],
         "colors": colors,
+        "color_coverage": from_json(row["color_coverage"]) or [],
+        "status": row["status"],
         "created_at": row["created_at"],
         "tags": tags_map.get(row["id"], []),
         "url": f"/media/{row['stored_name']}",
         "preview_url": preview_url,
+        "thumb_url": f"/media/{row['thumb_small_name']}" if row["thumb_small_name"] else None,
+        "thumb_medium_url": f"/media/{row['thumb_medium_name']}" if row["thumb_medium_name"] else None,
     }
 
 
+# The fields of asset_to_dict as SQL, so list pages go straight from rows to
+# JSON text without per-row dicts. Keep the two in sync. The flag marks
+# expressions that already yield JSON text.
+ASSET_FIELDS: Dict[str, Tuple[str, bool]] = {
+    "id": ("assets.id", False),
+    "filename": ("assets.filename", False),
+    "stored_name": ("assets.stored_name", False),
+    "preview_name": ("assets.preview_name", False),
+    "media_type": ("assets.media_type", False),
+    "mime": ("assets.mime", False),
+    "format": ("assets.format", False),
+    "size_bytes": ("assets.size_bytes", False),
+    "width": ("assets.width", False),
+    "height": ("assets.height", False),
+    "duration_ms": ("assets.duration_ms", False),
+    "folder_id": ("assets.folder_id", False),
+    "note": ("assets.note", False),
+    "colors": ("CASE WHEN json_valid(assets.colors) THEN assets.colors ELSE '[]' END", True),
+    "color_coverage": ("CASE WHEN json_valid(assets.color_coverage) THEN assets.color_coverage ELSE '[]' END", True),
+    "status": ("assets.status", False),
+    "created_at": ("assets.created_at", False),
+    "tags": (
+        """(
+            SELECT json_group_array(tags.name) FROM asset_tags
+            JOIN tags ON tags.id = asset_tags.tag_id
+            WHERE asset_tags.asset_id = assets.id
+        )""",
+        True,
+    ),
+    "url": ("'/media/' || assets.stored_name", False),
+    "preview_url": (
+        """CASE
+            WHEN nullif(assets.preview_name, '') IS NOT NULL THEN '/media/' || assets.preview_name
+            WHEN assets.media_type = 'raw' OR assets.format = 'dng' THEN '/assets/' || assets.id || '/preview'
+        END""",
+        False,
+    ),
+    "thumb_url": ("'/media/' || nullif(assets.thumb_small_name, '')", False),
+    "thumb_medium_url": ("'/media/' || nullif(assets.thumb_medium_name, '')", False),
+}
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(ASSET_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ASSET_FIELDS]
+    if unknown or not names:
+        raise HTTPException(400, f"unknown fields: {', '.join(unknown) or '(none)'}")
+    return list(dict.fromkeys(names))
+
+
+def asset_json_sql(names: List[str]) -> str:
+    pairs = []
+    for name in names:
+        expr, is_json = ASSET_FIELDS[name]
+        pairs.append(f"'{name}', " + (f"json({expr})" if is_json else expr))
+    return "json_object(" + ", ".join(pairs) + ")"
+
+
+def encode_asset_columns(rows, names: List[str]) -> str:
+    # One array per field instead of one object per asset: key names appear
+    # once per page, and JSON.parse builds a handful of arrays, not N objects.
+    columns = []
+    for index, name in enumerate(names):
+        if ASSET_FIELDS[name][1]:
+            values = "[" + ",".join(row[index] for row in rows) + "]"
+        else:
+            values = json.dumps([row[index] for row in rows], ensure_ascii=False, separators=(",", ":"))
+        columns.append(f'"{name}":{values}')
+    return "{" + ",".join(columns) + "}"
+
+
 def sanitize_path(path_value: str) -> str:
     path_value = path_value.replace("\\", "/")
     parts = [p for p in path_value.split("/") if p and p not in {".", ".."}]
@@ -283,61 +332,227 @@ def split_dir_file(path_value: str) -> Tuple[Optional[str], str]:
     return folder or None, filename
 
 
-def get_or_create_folder_by_path(path_value: str) -> Optional[int]:
-    if not path_value:
-        return None
-    parts = [p for p in sanitize_path(path_value).split("/") if p]
-    if not parts:
-        return None
-    parent_id = None
-    current_path = ""
-    for part in parts:
-        current_path = f"{current_path}/{part}" if current_path else part
-        row = fetch_one("SELECT id FROM folders WHERE path = ?", (current_path,))
-        if row:
-            parent_id = row["id"]
-            continue
-        folder_id = execute(
-            "INSERT INTO folders(name, parent_id, path, created_at) VALUES (?, ?, ?, ?)",
-            (part, parent_id, current_path, now_iso()),
+# Folder path -> id. Folders are only ever created or deleted (never renamed),
+# but another server process may delete one, so hits are re-checked by id.
+_folder_ids: Dict[str, int] = {}
+_folder_ids_lock = threading.Lock()
+
+
+def ensure_folders(paths: Iterable[str]) -> Dict[str, int]:
+    """Folder ids for paths, creating missing folders and their parents.
+
+    Must not run inside another transaction: ids are cached only once the
+    folders they name are committed.
+    """
+    wanted = {path for path in (sanitize_path(value or "") for value in paths) if path}
+    with _folder_ids_lock:
+        cached = {path: _folder_ids[path] for path in wanted if path in _folder_ids}
+    result = {}
+    if cached:
+        rows = fetch_all(
+            f"SELECT id, path FROM folders WHERE id IN ({','.join('?' for _ in cached)})",
+            list(cached.values()),
         )
-        parent_id = folder_id
-    return parent_id
+        live = {(row["path"], row["id"]) for row in rows}
+        result = {path: folder_id for path, folder_id in cached.items() if (path, folder_id) in live}
+        if len(result) < len(cached):
+            with _folder_ids_lock:
+                for path in cached.keys() - result.keys():
+                    if _folder_ids.get(path) == cached[path]:
+                        del _folder_ids[path]
+    missing = wanted - result.keys()
+    if not missing:
+        return result
+    needed = set()
+    for path in missing:
+        parts = path.split("/")
+        needed.update("/".join(parts[: depth + 1]) for depth in range(len(parts)))
+    created_at = now_iso()
+    with transaction():
+        rows = fetch_all(f"SELECT id, path FROM folders WHERE path IN ({','.join('?' for _ in needed)})", list(needed))
+        ids = {row["path"]: row["id"] for row in rows}
+        # Parents sort before their children, so parent ids are known in time.
+        for path in sorted(needed - ids.keys(), key=lambda value: (value.count("/"), value)):
+            parent, _, name = path.rpartition("/")
+            row = fetch_one(
+                """
+                INSERT INTO folders(name, parent_id, path, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(path) DO NOTHING RETURNING id
+                """,
+                (name, ids.get(parent), path, created_at),
+            ) or fetch_one("SELECT id FROM folders WHERE path = ?", (path,))
+            ids[path] = row["id"]
+    with _folder_ids_lock:
+        _folder_ids.update(ids)
+    return {**result, **{path: ids[path] for path in missing}}
 
 
-def color_distance(a, b) -> float:
-    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2) ** 0.5
+def get_or_create_folder_by_path(path_value: str) -> Optional[int]:
+    path = sanitize_path(path_value or "")
+    return ensure_folders([path])[path] if path else None
 
 
-def parse_hex_color(value: str):
-    value = value.strip().lstrip("#")
-    if len(value) != 6:
-        return None
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Tuple[type, ...]) -> List:
     try:
-        r = int(value[0:2], 16)
-        g = int(value[2:4], 16)
-        b = int(value[4:6], 16)
-        return (r, g, b)
-    except ValueError:
-        return None
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(400, "invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise HTTPException(400, "invalid cursor")
+    # bool is an int subclass, so compare exact types.
+    if any(type(value) is not kind for value, kind in zip(values, types)):
+        raise HTTPException(400, "invalid cursor")
+    return values
+
+
+def search_terms(q: str) -> Tuple[Optional[str], List[str]]:
+    # The trigram tokenizer can only MATCH terms of three or more characters;
+    # shorter terms (common for Chinese words) fall back to LIKE on the index.
+    match_terms = []
+    like_terms = []
+    for term in q.split():
+        if len(term) >= 3:
+            match_terms.append('"' + term.replace('"', '""') + '"')
+        else:
+            like_terms.append(term)
+    return (" ".join(match_terms) or None), like_terms
+
 
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
-def match_color(asset_colors: List[str], target_hex: str, threshold: float) -> bool:
-    target_rgb = parse_hex_color(target_hex)
-    if not target_rgb:
-        return False
-    for hex_color in asset_colors:
-        rgb = parse_hex_color(hex_color)
-        if not rgb:
-            continue
-        if color_distance(rgb, target_rgb) <= threshold:
-            return True
-    return False
+
+def index_asset_colors(asset_id: int, colors: List[str], coverage: Optional[List[float]] = None) -> None:
+    with transaction():
+        slots = slot_ids(asset_id)
+        execute(f"DELETE FROM asset_colors WHERE id IN ({','.join('?' for _ in slots)})", slots)
+        execute_many(
+            "INSERT INTO asset_colors VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            palette_rows(asset_id, colors, coverage),
+        )
+        execute("UPDATE assets SET color_bucket = ? WHERE id = ?", (color_bucket(colors), asset_id))
+
+
+def build_asset_filters(
+    q: Optional[str] = None,
+    tags: Optional[str] = None,
+    annotations: Optional[str] = None,
+    folder_id: Optional[str] = None,
+    format: Optional[str] = None,
+    media_type: Optional[str] = None,
+    min_w: Optional[int] = None,
+    max_w: Optional[int] = None,
+    min_h: Optional[int] = None,
+    max_h: Optional[int] = None,
+    color: Optional[str] = None,
+    color_threshold: Optional[float] = DEFAULT_DELTA_E,
+    color_coverage: Optional[float] = None,
+    include_descendants: bool = False,
+    include_match: bool = True,
+) -> Tuple[str, List]:
+    sql = "1=1"
+    params: List = []
+    if folder_id and include_descendants:
+        ids = [item for item in str(folder_id).split(",") if item.strip().isdigit()]
+        if ids:
+            # The folders themselves plus every path below them: '0' sorts
+            # right after '/', so each subtree is one range on the path index.
+            sql += f"""
+            AND assets.folder_id IN (
+                SELECT sub.id FROM folders AS top
+                JOIN folders AS sub
+                    ON sub.path = top.path OR (sub.path > top.path || '/' AND sub.path < top.path || '0')
+                WHERE top.id IN ({','.join('?' for _ in ids)})
+            )"""
+            params.extend(ids)
+    elif folder_id:
+        if isinstance(folder_id, str) and "," in folder_id:
+            ids = [item for item in folder_id.split(",") if item.strip().isdigit()]
+            if ids:
+                sql += f" AND assets.folder_id IN ({','.join('?' for _ in ids)})"
+                params.extend(ids)
+        else:
+            sql += " AND assets.folder_id = ?"
+            params.append(folder_id)
+    if format:
+        if isinstance(format, str) and "," in format:
+            formats = [item.strip().lower() for item in format.split(",") if item.strip()]
+            if formats:
+                sql += f" AND assets.format IN ({','.join('?' for _ in formats)})"
+                params.extend(formats)
+        else:
+            sql += " AND assets.format = ?"
+            params.append(format.lower())
+    if media_type:
+        sql += " AND assets.media_type = ?"
+        params.append(media_type)
+    if min_w is not None:
+        sql += " AND (assets.width >= ? OR assets.width IS NULL)"
+        params.append(min_w)
+    if max_w is not None:
+        sql += " AND (assets.width <= ? OR assets.width IS NULL)"
+        params.append(max_w)
+    if min_h is not None:
+        sql += " AND (assets.height >= ? OR assets.height IS NULL)"
+        params.append(min_h)
+    if max_h is not None:
+        sql += " AND (assets.height <= ? OR assets.height IS NULL)"
+        params.append(max_h)
+    tag_filters = normalize_tags(tags)
+    if tag_filters:
+        sql += f"""
+            AND EXISTS (
+                SELECT 1 FROM asset_tags
+                JOIN tags ON tags.id = asset_tags.tag_id
+                WHERE asset_tags.asset_id = assets.id
+                AND tags.name IN ({','.join('?' for _ in tag_filters)})
+            )"""
+        params.extend(tag_filters)
+    annotation_filters = normalize_annotations(annotations)
+    if annotation_filters:
+        sql += f"""
+            AND assets.id IN (
+                SELECT asset_id FROM annotations
+                WHERE text IN ({','.join('?' for _ in annotation_filters)})
+            )"""
+        params.extend(annotation_filters)
+    if q:
+        match, like_terms = search_terms(q)
+        if match and include_match:
+            sql += " AND assets.id IN (SELECT rowid FROM assets_fts WHERE assets_fts MATCH ?)"
+            params.append(match)
+        for term in like_terms:
+            sql += """
+            AND assets.id IN (
+                SELECT rowid FROM assets_fts
+                WHERE filename LIKE ? ESCAPE '\\' OR note LIKE ? ESCAPE '\\'
+                OR tags LIKE ? ESCAPE '\\' OR annotations LIKE ? ESCAPE '\\'
+            )"""
+            params.extend([f"%{escape_like(term)}%"] * 4)
+    color_filters = [c.strip() for c in color.split(",") if c.strip()] if color else []
+    if color_filters:
+        color_sql, color_params = color_filter(color_filters, color_threshold or DEFAULT_DELTA_E, color_coverage)
+        sql += color_sql
+        params.extend(color_params)
+    return sql, params
 
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    start_workers()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_workers()
+    close_pool()
 
 
 @app.get("/health")
@@ -348,7 +563,25 @@ def health():
 @app.get("/folders")
 def list_folders():
     rows = fetch_all("SELECT * FROM folders ORDER BY path")
-    return [dict(row) for row in rows]
+    result = [dict(row) for row in rows]
+    # Subtree totals from the per-folder counters: deepest paths first, each
+    # folder adds its totals to its nearest ancestor path (the same subtree
+    # include_descendants selects).
+    by_path = {}
+    for item in result:
+        item["total_count"] = item["asset_count"]
+        item["total_bytes"] = item["size_bytes"]
+        by_path[item["path"]] = item
+    for item in sorted(result, key=lambda item: item["path"].count("/"), reverse=True):
+        path = item["path"]
+        while "/" in path:
+            path = path.rpartition("/")[0]
+            parent = by_path.get(path)
+            if parent is not None:
+                parent["total_count"] += item["total_count"]
+                parent["total_bytes"] += item["total_bytes"]
+                break
+    return result
 
 
 @app.post("/folders")
@@ -371,12 +604,19 @@ def create_folder(payload: Dict = Body(...)):
         )
     except Exception as exc:
         raise HTTPException(400, f"create folder failed: {exc}")
-    # Ensure physical directory exists for this folder path
-    if path:
-        (STORAGE_DIR / sanitize_path(path)).mkdir(parents=True, exist_ok=True)
+    with _folder_ids_lock:
+        _folder_ids[path] = folder_id
     return {"id": folder_id, "name": name, "parent_id": parent_id, "path": path, "created_at": created_at}
 
 
+@app.post("/folders/ensure")
+def ensure_folder_paths(payload: Dict = Body(...)):
+    paths = payload.get("paths")
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        raise HTTPException(400, "paths must be a list of strings")
+    return ensure_folders(paths)
+
+
 @app.delete("/folders/{folder_id}")
 def delete_folder(folder_id: int):
     row = fetch_one("SELECT id, path FROM folders WHERE id = ?", (folder_id,))
@@ -389,177 +629,498 @@ def delete_folder(folder_id: int):
     if asset:
         raise HTTPException(400, "folder not empty")
     execute("DELETE FROM folders WHERE id = ?", (folder_id,))
-    try:
-        target = STORAGE_DIR / sanitize_path(row["path"])
-        target.rmdir()
-    except Exception:
-        pass
+    with _folder_ids_lock:
+        _folder_ids.pop(row["path"], None)
     return {"status": "deleted"}
 
 
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    # Smallest string greater than every string starting with prefix, so
+    # "name >= prefix AND name < bound" is a range scan on the name index.
+    # None when the prefix is all U+10FFFF and nothing sorts above it.
+    stripped = prefix.rstrip("\U0010ffff")
+    if not stripped:
+        return None
+    code = ord(stripped[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # Surrogates cannot be encoded as UTF-8 for SQLite; skip past them.
+        code = 0xE000
+    return stripped[:-1] + chr(code)
+
+
 @app.get("/tags")
-def list_tags():
-    rows = fetch_all(
-        """
-        SELECT tags.name, COUNT(asset_tags.asset_id) as count
-        FROM tags
-        LEFT JOIN asset_tags ON asset_tags.tag_id = tags.id
-        GROUP BY tags.id
-        ORDER BY tags.name
-        """
-    )
+def list_tags(prefix: Optional[str] = None, limit: Optional[int] = None):
+    if prefix:
+        # Autocomplete: the most used matches first.
+        bound = prefix_upper_bound(prefix)
+        rows = fetch_all(
+            f"""
+            SELECT name, asset_count AS count FROM tags
+            WHERE name >= ?{" AND name < ?" if bound is not None else ""}
+            ORDER BY asset_count DESC, name
+            LIMIT ?
+            """,
+            (prefix, *([bound] if bound is not None else []), max(1, min(limit or 20, 1000))),
+        )
+    else:
+        rows = fetch_all(
+            "SELECT name, asset_count AS count FROM tags ORDER BY name LIMIT ?",
+            (limit if limit and limit > 0 else -1,),
+        )
     return [dict(row) for row in rows]
 
 
-@app.post("/assets")
-async def upload_asset(
-    file: UploadFile = File(...),
-    folder_id: Optional[int] = Form(None),
-    tags: Optional[str] = Form(None),
-    note: Optional[str] = Form(None),
-    relative_path: Optional[str] = Form(None),
-):
-    filename = file.filename
-    if not filename:
-        raise HTTPException(400, "filename required")
+def describe_upload(
+    filename: str, content_type: Optional[str], relative_path: Optional[str]
+) -> Tuple[str, Optional[str], str, Optional[str], str]:
     rel_dir = None
     if relative_path:
         rel_dir, rel_filename = split_dir_file(relative_path)
         if rel_filename:
             filename = rel_filename
     ext = file_extension(filename)
-    mime = sniff_mime(filename, file.content_type)
+    mime = sniff_mime(filename, content_type)
     media_type = detect_media_type(mime, ext)
     if is_raw_extension(ext):
         media_type = "raw"
+    return filename, rel_dir, ext, mime, media_type
 
-    folder_id = get_or_create_folder_by_path(rel_dir) if relative_path else folder_id
-    storage_subdir = None
-    if rel_dir:
-        storage_subdir = rel_dir
-    elif folder_id:
-        folder_row = fetch_one("SELECT path FROM folders WHERE id = ?", (folder_id,))
-        if folder_row:
-            storage_subdir = folder_row["path"]
-
-    stored_filename = f"{uuid4().hex}.{ext}" if ext else uuid4().hex
-    if storage_subdir:
-        stored_name = f"{sanitize_path(storage_subdir)}/{stored_filename}"
-        dest = STORAGE_DIR / sanitize_path(storage_subdir) / stored_filename
-        dest.parent.mkdir(parents=True, exist_ok=True)
-    else:
-        stored_name = stored_filename
-        dest = STORAGE_DIR / stored_name
-    with dest.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    size_bytes = dest.stat().st_size
-    width = height = None
-    colors: List[str] = []
-    preview_name = None
-    duration_ms = None
-    if media_type in {"image", "gif"}:
-        width, height, colors = image_metadata(dest)
-        if ext == "heic":
-            try:
-                from PIL import Image
-                from .utils import pillow_heif
-
-                preview_filename = f"{uuid4().hex}.jpg"
-                if storage_subdir:
-                    preview_name = f"{sanitize_path(storage_subdir)}/{preview_filename}"
-                    preview_path = STORAGE_DIR / sanitize_path(storage_subdir) / preview_filename
-                    preview_path.parent.mkdir(parents=True, exist_ok=True)
-                else:
-                    preview_name = preview_filename
-                    preview_path = STORAGE_DIR / preview_filename
-                if pillow_heif is not None:
-                    heif_file = pillow_heif.read_heif(str(dest))
-                    img = Image.frombytes(
-                        heif_file.mode,
-                        heif_file.size,
-                        heif_file.data,
-                        "raw",
-                        heif_file.mode,
-                        heif_file.stride,
-                    ).convert("RGB")
-                else:
-                    img = Image.open(dest).convert("RGB")
-                img.thumbnail((1600, 1600))
-                img.save(preview_path, "JPEG", quality=90)
-            except Exception as exc:
-                preview_name = None
-                print(f"[heic-preview] failed to decode {dest.name}: {exc!r}")
-    elif media_type == "raw":
-        preview_img, width, height, colors = raw_preview(dest)
-        if preview_img:
-            preview_filename = f"{uuid4().hex}.jpg"
-            if storage_subdir:
-                preview_name = f"{sanitize_path(storage_subdir)}/{preview_filename}"
-                preview_path = STORAGE_DIR / sanitize_path(storage_subdir) / preview_filename
-                preview_path.parent.mkdir(parents=True, exist_ok=True)
-            else:
-                preview_name = preview_filename
-                preview_path = STORAGE_DIR / preview_filename
-            preview_img.thumbnail((1600, 1600))
-            preview_img.save(preview_path, "JPEG", quality=90)
-    elif media_type == "video":
-        width, height, duration_ms = ffprobe_metadata(dest)
-        if duration_ms:
-            duration_ms = int(duration_ms)
-        preview_filename = f"{uuid4().hex}.jpg"
-        if storage_subdir:
-            preview_name = f"{sanitize_path(storage_subdir)}/{preview_filename}"
-            preview_path = STORAGE_DIR / sanitize_path(storage_subdir) / preview_filename
-        else:
-            preview_name = preview_filename
-            preview_path = STORAGE_DIR / preview_filename
-        if ffmpeg_thumbnail(dest, preview_path):
-            preview_name = preview_name
-        else:
-            preview_name = None
 
+@app.post("/assets")
+async def upload_asset(
+    file: UploadFile = File(...),
+    folder_id: Optional[int] = Form(None),
+    tags: Optional[str] = Form(None),
+    note: Optional[str] = Form(None),
+    relative_path: Optional[str] = Form(None),
+    on_duplicate: Optional[str] = Form(None),
+):
+    if not file.filename:
+        raise HTTPException(400, "filename required")
+    policy = dedup_policy(on_duplicate)
+    filename, _, ext, mime, media_type = describe_upload(file.filename, file.content_type, relative_path)
+    staged = staging_target(ext)
+    try:
+        size_bytes, content_hash = await run_in_threadpool(
+            copy_and_hash, file.file, staged, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+        )
+    except UploadTooLarge:
+        raise HTTPException(413, "file too large")
+
+    return await run_in_threadpool(
+        create_asset_record,
+        filename=filename,
+        staged_path=staged,
+        media_type=media_type,
+        mime=mime,
+        ext=ext,
+        size_bytes=size_bytes,
+        content_hash=content_hash,
+        folder_id=folder_id,
+        relative_path=relative_path,
+        tags=tags,
+        note=note,
+        on_duplicate=policy,
+    )
+
+
+def dedup_policy(value: Optional[str]) -> str:
+    policy = value or DEDUP_POLICY
+    if policy not in DEDUP_POLICIES:
+        raise HTTPException(400, f"on_duplicate must be one of {', '.join(sorted(DEDUP_POLICIES))}")
+    return policy
+
+
+def find_duplicate(content_hash: Optional[str]):
+    if not content_hash:
+        return None
+    # Prefer a fully ingested row so "share" can reuse its derivatives.
+    return fetch_one(
+        "SELECT * FROM assets WHERE content_hash = ? ORDER BY status = 'ready' DESC, id LIMIT 1",
+        (content_hash,),
+    )
+
+
+def create_asset_record(
+    filename: str,
+    staged_path: Path,
+    media_type: str,
+    mime: Optional[str],
+    ext: str,
+    size_bytes: int,
+    content_hash: Optional[str],
+    folder_id: Optional[int],
+    relative_path: Optional[str],
+    tags: Optional[str],
+    note: Optional[str],
+    on_duplicate: Optional[str] = None,
+    keep_staged: bool = False,
+) -> Dict:
+    policy = dedup_policy(on_duplicate)
+    tags_final = set(normalize_tags(tags))
     created_at = now_iso()
-    asset_id = execute(
+    if relative_path:
+        folder_id = get_or_create_folder_by_path(split_dir_file(relative_path)[0])
+    try:
+        with transaction():
+            duplicate = find_duplicate(content_hash)
+            if duplicate is not None and policy == "reject":
+                raise HTTPException(409, f"duplicate of asset {duplicate['id']}")
+            if duplicate is not None and policy == "link":
+                print(f"[upload] duplicate of id={duplicate['id']} linked")
+                return asset_to_dict(duplicate, get_tags_for_assets([duplicate["id"]]))
+
+            if duplicate is not None and (STORAGE_DIR / duplicate["stored_name"]).exists():
+                stored_name = duplicate["stored_name"]
+            else:
+                stored_name = blob_name(content_hash or uuid4().hex, f".{ext}" if ext else "")
+                store_blob(staged_path, stored_name)
+            shared = duplicate is not None and duplicate["status"] == "ready"
+            if shared:
+                # Same bytes: reuse everything already decoded from the blob.
+                derived = {
+                    key: duplicate[key]
+                    for key in (
+                        "preview_name",
+                        "thumb_small_name",
+                        "thumb_medium_name",
+                        "width",
+                        "height",
+                        "duration_ms",
+                        "colors",
+                        "color_coverage",
+                    )
+                }
+                needs_processing = False
+                tags_final.update(tag for tag in auto_tags(media_type, ext, derived["width"], derived["height"]) if tag)
+            else:
+                derived = {"colors": to_json([])}
+                needs_processing = media_type in PROCESSED_MEDIA_TYPES
+                if not needs_processing:
+                    tags_final.update(tag for tag in auto_tags(media_type, ext, None, None) if tag)
+
+            values = {
+                **derived,
+                "filename": filename,
+                "stored_name": stored_name,
+                "media_type": media_type,
+                "mime": mime,
+                "format": ext,
+                "size_bytes": size_bytes,
+                "folder_id": folder_id,
+                "note": note,
+                "status": "processing" if needs_processing else "ready",
+                "content_hash": content_hash,
+                "created_at": created_at,
+            }
+            asset_id = execute(
+                f"INSERT INTO assets({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+                tuple(values.values()),
+            )
+            tag_names = set_asset_tags(asset_id, sorted(tags_final))
+            if shared:
+                index_asset_colors(asset_id, from_json(derived["colors"]) or [], from_json(derived["color_coverage"]))
+            if needs_processing:
+                enqueue_job("ingest", asset_id)
+            row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
+    finally:
+        if not keep_staged:
+            staged_path.unlink(missing_ok=True)
+
+    print(
+        f"[upload] id={asset_id} ext={ext} media_type={media_type} status={row['status']}"
+        + (f" duplicate_of={duplicate['id']}" if duplicate is not None else "")
+    )
+    return asset_to_dict(row, {asset_id: tag_names})
+
+
+def upload_claimed(row) -> bool:
+    # A complete in progress; its claim lapses once its process stops beating.
+    return row["state"] == "completing" and (row["claimed_at"] or "") >= now_iso(-JOB_STALE_SECONDS)
+
+
+def touch_upload_claims(process_id: str, now: str) -> None:
+    execute(
+        "UPDATE uploads SET claimed_at = ? WHERE state = 'completing' AND claimed_by = ?",
+        (now, process_id),
+    )
+
+
+register_heartbeat(touch_upload_claims)
+
+
+def upload_staging_path(upload_id: str) -> Path:
+    return UPLOAD_STAGING_DIR / f"{upload_id}.part"
+
+
+def upload_chunk_count(row) -> int:
+    return (row["size_bytes"] + row["chunk_size"] - 1) // row["chunk_size"]
+
+
+def upload_status(upload_id: str) -> Dict:
+    row = fetch_one("SELECT * FROM uploads WHERE id = ?", (upload_id,))
+    if not row:
+        raise HTTPException(404, "upload not found")
+    received = fetch_all("SELECT idx FROM upload_chunks WHERE upload_id = ? ORDER BY idx", (upload_id,))
+    return {
+        "id": row["id"],
+        "filename": row["filename"],
+        "size": row["size_bytes"],
+        "chunk_size": row["chunk_size"],
+        "chunks": upload_chunk_count(row),
+        "received": [item["idx"] for item in received],
+        "state": row["state"],
+        "created_at": row["created_at"],
+    }
+
+
+@app.post("/uploads")
+def create_upload(payload: Dict = Body(...)):
+    filename = (payload.get("filename") or "").strip()
+    size = payload.get("size")
+    if not filename or not isinstance(size, int) or size < 0:
+        raise HTTPException(400, "filename and size required")
+    if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+        raise HTTPException(413, "file too large")
+    upload_id = uuid4().hex
+    UPLOAD_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    with upload_staging_path(upload_id).open("wb") as handle:
+        handle.truncate(size)
+    execute(
         """
-        INSERT INTO assets(filename, stored_name, preview_name, media_type, mime, format, size_bytes, width, height, duration_ms, folder_id, note, colors, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO uploads(id, filename, mime, size_bytes, chunk_size, folder_id, relative_path, tags, note, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
+            upload_id,
             filename,
-            stored_name,
-            preview_name,
-            media_type,
-            mime,
-            ext,
-            size_bytes,
-            width,
-            height,
-            duration_ms,
-            folder_id,
-            note,
-            to_json(colors),
-            created_at,
+            payload.get("mime"),
+            size,
+            RESUMABLE_CHUNK_SIZE,
+            payload.get("folder_id"),
+            payload.get("relative_path"),
+            payload.get("tags"),
+            payload.get("note"),
+            now_iso(),
         ),
     )
+    return upload_status(upload_id)
+
+
+@app.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    return upload_status(upload_id)
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    row = await run_in_threadpool(fetch_one, "SELECT * FROM uploads WHERE id = ?", (upload_id,))
+    if not row:
+        raise HTTPException(404, "upload not found")
+    if upload_claimed(row):
+        raise HTTPException(409, "upload is completing")
+    chunk_size = row["chunk_size"]
+    if offset < 0 or offset % chunk_size or offset >= row["size_bytes"]:
+        raise HTTPException(400, "invalid offset")
+    expected = min(chunk_size, row["size_bytes"] - offset)
+    data = bytearray()
+    async for piece in request.stream():
+        data.extend(piece)
+        if len(data) > expected:
+            raise HTTPException(400, "chunk too large")
+    if len(data) != expected:
+        raise HTTPException(400, "incomplete chunk")
+    staging = upload_staging_path(upload_id)
+    await run_in_threadpool(write_at, staging, offset, bytes(data))
+    await run_in_threadpool(
+        execute,
+        "INSERT OR IGNORE INTO upload_chunks(upload_id, idx) VALUES (?, ?)",
+        (upload_id, offset // chunk_size),
+    )
+    return {"offset": offset, "length": expected}
+
+
+@app.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str, on_duplicate: Optional[str] = None):
+    policy = dedup_policy(on_duplicate)
+    # Claim the session so a concurrent or retried complete cannot create a
+    # second asset from the same bytes. A claim whose process stopped beating
+    # died with it and may be taken over.
+    now = now_iso()
+    rows = fetch_all(
+        """
+        UPDATE uploads SET state = 'completing', claimed_by = ?, claimed_at = ?
+        WHERE id = ? AND (state = 'open' OR (state = 'completing' AND COALESCE(claimed_at, '') < ?))
+        RETURNING *
+        """,
+        (PROCESS_ID, now, upload_id, now_iso(-JOB_STALE_SECONDS)),
+    )
+    if not rows:
+        if fetch_one("SELECT 1 FROM uploads WHERE id = ?", (upload_id,)):
+            raise HTTPException(409, "upload is completing")
+        raise HTTPException(404, "upload not found")
+    row = rows[0]
+    staging = upload_staging_path(upload_id)
+    rejected = False
+    try:
+        received = fetch_one("SELECT COUNT(*) AS count FROM upload_chunks WHERE upload_id = ?", (upload_id,))["count"]
+        if received < upload_chunk_count(row):
+            raise HTTPException(409, "upload incomplete")
+        filename, _, ext, mime, media_type = describe_upload(row["filename"], row["mime"], row["relative_path"])
+        content_hash = hash_file(staging)
+        folder_id = row["folder_id"]
+        if row["relative_path"]:
+            # Folders are created before the transaction below; ensure_folders
+            # must not run inside one.
+            folder_id = get_or_create_folder_by_path(split_dir_file(row["relative_path"])[0])
+        try:
+            with transaction():
+                result = create_asset_record(
+                    filename=filename,
+                    staged_path=staging,
+                    media_type=media_type,
+                    mime=mime,
+                    ext=ext,
+                    size_bytes=row["size_bytes"],
+                    content_hash=content_hash,
+                    folder_id=folder_id,
+                    relative_path=None,
+                    tags=row["tags"],
+                    note=row["note"],
+                    on_duplicate=policy,
+                    keep_staged=True,
+                )
+                execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        except HTTPException as exc:
+            # The only 409 create_asset_record raises is a rejected duplicate.
+            rejected = exc.status_code == 409
+            raise
+    except BaseException:
+        # Hand the session back so the client can retry or resume it, unless
+        # its bytes were rejected or the staged file is already gone.
+        if staging.exists() and not rejected:
+            execute(
+                "UPDATE uploads SET state = 'open', claimed_by = NULL, claimed_at = NULL WHERE id = ? AND claimed_by = ?",
+                (upload_id, PROCESS_ID),
+            )
+        else:
+            execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            staging.unlink(missing_ok=True)
+        raise
+    staging.unlink(missing_ok=True)
+    return result
+
 
-    user_tags = normalize_tags(tags)
-    tags_final = set(user_tags)
-    for tag in auto_tags(media_type, ext, width, height):
-        if tag:
-            tags_final.add(tag)
-    tag_names = set_asset_tags(asset_id, sorted(tags_final))
+@app.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+    upload_staging_path(upload_id).unlink(missing_ok=True)
+    return {"status": "deleted"}
 
+
+def process_asset(asset_id: int) -> None:
+    row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
+    if not row:
+        return
+    dest = STORAGE_DIR / row["stored_name"]
+    media_type = row["media_type"]
+    ext = row["format"] or ""
+    # Derivatives are keyed by the source hash, so identical uploads share them.
+    key = row["content_hash"] or uuid4().hex
+
+    preview_path = staging_target("jpg")
+    thumb_paths = {label: staging_target("webp") for label in THUMB_SIZES}
+    try:
+        result = run_in_process(render_derivatives, dest, media_type, ext, preview_path, thumb_paths)
+        width = result["width"]
+        height = result["height"]
+        colors = result["colors"]
+        color_coverage = result["color_coverage"]
+        duration_ms = result["duration_ms"]
+        preview_name = blob_name(key, ".preview.jpg") if result["preview"] else None
+        thumb_names = {label: blob_name(key, f".{label}.webp") for label in result["thumbs"]}
+
+        with transaction():
+            if preview_name:
+                store_blob(preview_path, preview_name)
+            for label, name in thumb_names.items():
+                store_blob(thumb_paths[label], name)
+            execute(
+                """
+                UPDATE assets
+                SET preview_name = ?, thumb_small_name = ?, thumb_medium_name = ?,
+                    width = ?, height = ?, duration_ms = ?, colors = ?, color_coverage = ?, status = 'ready'
+                WHERE id = ?
+                """,
+                (
+                    preview_name,
+                    thumb_names.get("small"),
+                    thumb_names.get("medium"),
+                    width,
+                    height,
+                    duration_ms,
+                    to_json(colors),
+                    to_json(color_coverage),
+                    asset_id,
+                ),
+            )
+            index_asset_colors(asset_id, colors, color_coverage)
+            add_asset_tags(asset_id, [tag for tag in auto_tags(media_type, ext, width, height) if tag])
+            release_blobs()
+    finally:
+        for path in [preview_path, *thumb_paths.values()]:
+            path.unlink(missing_ok=True)
     print(
-        f"[upload-image] id={asset_id} ext={ext} media_type={media_type} "
+        f"[ingest] id={asset_id} ext={ext} media_type={media_type} "
         f"preview_name={preview_name} size={width}x{height}"
     )
-    row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
-    return asset_to_dict(row, {asset_id: tag_names})
+
+
+def fail_asset(asset_id: int) -> None:
+    row = fetch_one("SELECT media_type, format FROM assets WHERE id = ? AND status = 'processing'", (asset_id,))
+    if not row:
+        return
+    # Decoding gave up: keep the original usable with the tags that need no decode.
+    execute("UPDATE assets SET status = 'failed' WHERE id = ?", (asset_id,))
+    add_asset_tags(asset_id, [tag for tag in auto_tags(row["media_type"], row["format"] or "", None, None) if tag])
+    print(f"[ingest] id={asset_id} failed permanently")
+
+
+register_handler("ingest", process_asset, on_failure=fail_asset)
+
+
+@app.get("/gc")
+def storage_gc_status():
+    return gc_status()
+
+
+@app.post("/gc")
+def storage_gc(dry_run: bool = True, max_items: int = 5000, restart: bool = False):
+    try:
+        return run_gc(dry_run=dry_run, max_items=max_items, restart=restart)
+    except GCBusy:
+        raise HTTPException(409, "gc already running")
+
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    sql = """
+        SELECT jobs.*, assets.filename
+        FROM jobs
+        LEFT JOIN assets ON assets.id = jobs.asset_id
+    """
+    params: List = []
+    if status:
+        sql += " WHERE jobs.status = ?"
+        params.append(status)
+    sql += " ORDER BY jobs.id DESC LIMIT ?"
+    params.append(max(1, min(limit, 500)))
+    return {"counts": job_counts(), "jobs": [dict(row) for row in fetch_all(sql, params)]}
 
 
 @app.get("/assets")
 def list_assets(
+    request: Request,
     q: Optional[str] = None,
     tags: Optional[str] = None,
     annotations: Optional[str] = None,
@@ -571,86 +1132,196 @@ def list_assets(
     min_h: Optional[int] = None,
     max_h: Optional[int] = None,
     color: Optional[str] = None,
-    color_threshold: Optional[float] = 60.0,
+    color_threshold: Optional[float] = DEFAULT_DELTA_E,
+    color_coverage: Optional[float] = None,
+    include_descendants: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+    fields: Optional[str] = None,
+    columnar: bool = False,
 ):
-    sql = "SELECT * FROM assets WHERE 1=1"
-    params: List = []
-    if folder_id:
-        if isinstance(folder_id, str) and "," in folder_id:
-            ids = [item for item in folder_id.split(",") if item.strip().isdigit()]
-            if ids:
-                sql += f" AND folder_id IN ({','.join('?' for _ in ids)})"
-                params.extend(ids)
+    names = parse_fields(fields)
+    match = search_terms(q)[0] if q else None
+    where, params = build_asset_filters(
+        q=q,
+        tags=tags,
+        annotations=annotations,
+        folder_id=folder_id,
+        format=format,
+        media_type=media_type,
+        min_w=min_w,
+        max_w=max_w,
+        min_h=min_h,
+        max_h=max_h,
+        color=color,
+        color_threshold=color_threshold,
+        color_coverage=color_coverage,
+        include_descendants=include_descendants,
+        include_match=False,
+    )
+    if match:
+        # Full-text searches are ranked by bm25; newest first breaks ties.
+        from_sql = f"""
+            FROM assets
+            JOIN (SELECT rowid, rank FROM assets_fts WHERE assets_fts MATCH ?) AS hits
+                ON hits.rowid = assets.id
+            WHERE {where}
+        """
+        params = [match] + params
+        order_by = " ORDER BY hits.rank, assets.created_at DESC, assets.id DESC"
+    else:
+        from_sql = f" FROM assets WHERE {where}"
+        order_by = " ORDER BY assets.created_at DESC, assets.id DESC"
+    if columnar:
+        select = ", ".join(ASSET_FIELDS[name][0] for name in names)
+    else:
+        select = asset_json_sql(names) + " AS json"
+    sql = f"SELECT {select}, assets.created_at AS page_created_at, assets.id AS page_id" + from_sql
+
+    def encode_rows(rows) -> str:
+        if columnar:
+            return f'"columns":{encode_asset_columns(rows, names)},"count":{len(rows)}'
+        return '"items":[' + ",".join(row["json"] for row in rows) + "]"
+
+    accept_encoding = request.headers.get("accept-encoding")
+    if limit is None and cursor is None:
+        rows = fetch_all(sql + order_by, params)
+        if columnar:
+            body = "{" + encode_rows(rows) + ',"next_cursor":null}'
         else:
-            sql += " AND folder_id = ?"
-            params.append(folder_id)
-    if format:
-        if isinstance(format, str) and "," in format:
-            formats = [item.strip().lower() for item in format.split(",") if item.strip()]
-            if formats:
-                sql += f" AND format IN ({','.join('?' for _ in formats)})"
-                params.extend(formats)
+            body = "[" + ",".join(row["json"] for row in rows) + "]"
+        return encoded_response(body.encode("utf-8"), accept_encoding)
+
+    page_size = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    page_sql = sql
+    page_params = list(params)
+    offset = 0
+    if match:
+        # Relevance order has no stable key to seek on, so ranked cursors carry an offset.
+        if cursor:
+            offset = decode_cursor(cursor, (int,))[0]
+            if offset < 0:
+                raise HTTPException(400, "invalid cursor")
+        page_sql += order_by + " LIMIT ? OFFSET ?"
+        page_params.extend([page_size + 1, offset])
+    else:
+        if cursor:
+            page_sql += " AND (assets.created_at, assets.id) < (?, ?)"
+            page_params.extend(decode_cursor(cursor, (str, int)))
+        page_sql += order_by + " LIMIT ?"
+        page_params.append(page_size + 1)
+    rows = fetch_all(page_sql, page_params)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = None
+    if has_more:
+        if match:
+            next_cursor = encode_cursor(offset + page_size)
         else:
-            sql += " AND format = ?"
-            params.append(format.lower())
-    if media_type:
-        sql += " AND media_type = ?"
-        params.append(media_type)
-    if min_w is not None:
-        sql += " AND (width >= ? OR width IS NULL)"
-        params.append(min_w)
-    if max_w is not None:
-        sql += " AND (width <= ? OR width IS NULL)"
-        params.append(max_w)
-    if min_h is not None:
-        sql += " AND (height >= ? OR height IS NULL)"
-        params.append(min_h)
-    if max_h is not None:
-        sql += " AND (height <= ? OR height IS NULL)"
-        params.append(max_h)
-    sql += " ORDER BY created_at DESC"
+            next_cursor = encode_cursor(rows[-1]["page_created_at"], rows[-1]["page_id"])
+    body = "{" + encode_rows(rows) + ',"next_cursor":' + json.dumps(next_cursor)
+    if with_total:
+        body += ',"total":' + str(fetch_one("SELECT COUNT(*) AS total" + from_sql, params)["total"])
+    return encoded_response((body + "}").encode("utf-8"), accept_encoding)
 
-    rows = fetch_all(sql, params)
-    asset_ids = [row["id"] for row in rows]
-    tag_filters = normalize_tags(tags)
-    q_lower = q.lower() if q else None
-    annotation_filters = normalize_annotations(annotations)
-    need_annotations = bool(q_lower or annotation_filters)
-    tags_map = get_tags_for_assets(asset_ids)
-    annotations_map = get_annotations_for_assets(asset_ids) if need_annotations else {}
-    color_filters = [c.strip() for c in color.split(",")] if color and "," in color else ([color] if color else [])
 
-    results = []
-    for row in rows:
-        asset = asset_to_dict(row, tags_map)
-        asset_tags = set(asset["tags"])
-
-        if tag_filters and not (set(tag_filters) & asset_tags):
-            continue
-        if annotation_filters:
-            asset_annotations = [text.lower() for text in annotations_map.get(asset["id"], [])]
-            if not set(annotation_filters) & set(asset_annotations):
-                continue
-        if q_lower:
-            annotation_text = " ".join(annotations_map.get(asset["id"], []))
-            hay = " ".join(
-                [
-                    asset["filename"],
-                    asset.get("note") or "",
-                    " ".join(asset["tags"]),
-                    annotation_text,
-                ]
-            )
-            if q_lower not in hay.lower():
-                continue
-        if color_filters:
-            if not asset.get("colors"):
-                continue
-            if not any(match_color(asset["colors"], c, color_threshold or 60.0) for c in color_filters if c):
-                continue
-        results.append(asset)
+# Filters that are also facets: each facet is counted with every filter
+# applied except its own, so the sidebar keeps offering the alternatives.
+FACET_FILTERS = ("format", "media_type", "tags", "folder_id", "color")
+MAX_COLOR_FACETS = 64
+
+
+@app.get("/assets/facets")
+def asset_facets(
+    q: Optional[str] = None,
+    tags: Optional[str] = None,
+    annotations: Optional[str] = None,
+    folder_id: Optional[str] = None,
+    format: Optional[str] = None,
+    media_type: Optional[str] = None,
+    min_w: Optional[int] = None,
+    max_w: Optional[int] = None,
+    min_h: Optional[int] = None,
+    max_h: Optional[int] = None,
+    color: Optional[str] = None,
+    color_threshold: Optional[float] = DEFAULT_DELTA_E,
+    color_coverage: Optional[float] = None,
+    include_descendants: bool = False,
+):
+    values = {"format": format, "media_type": media_type, "tags": tags, "folder_id": folder_id, "color": color}
+    options = {
+        "folder_id": {"include_descendants": include_descendants},
+        "color": {"color_threshold": color_threshold, "color_coverage": color_coverage},
+    }
+    flags = []
+    params: List = []
+    for name in FACET_FILTERS:
+        flag_sql, flag_params = build_asset_filters(**{name: values[name]}, **options.get(name, {}))
+        flags.append(f"({flag_sql}) AS by_{name}")
+        params.extend(flag_params)
+    base_where, base_params = build_asset_filters(
+        q=q, annotations=annotations, min_w=min_w, max_w=max_w, min_h=min_h, max_h=max_h
+    )
+    params.extend(base_params)
 
-    return results
+    def others(name: Optional[str] = None) -> str:
+        return " AND ".join(f"by_{other}" for other in FACET_FILTERS if other != name)
+
+    rows = fetch_all(
+        f"""
+        WITH base AS MATERIALIZED (
+            SELECT assets.id, assets.format, assets.media_type, assets.folder_id, assets.color_bucket,
+                {", ".join(flags)}
+            FROM assets WHERE {base_where}
+        )
+        SELECT 'total' AS facet, NULL AS value, COUNT(*) AS count
+        FROM base WHERE {others()}
+        UNION ALL
+        SELECT 'format', lower(format), COUNT(*)
+        FROM base WHERE {others("format")} AND coalesce(format, '') != '' GROUP BY lower(format)
+        UNION ALL
+        SELECT 'media_type', media_type, COUNT(*)
+        FROM base WHERE {others("media_type")} GROUP BY media_type
+        UNION ALL
+        SELECT 'folder', folder_id, COUNT(*)
+        FROM base WHERE {others("folder_id")} GROUP BY folder_id
+        UNION ALL
+        -- CROSS JOIN pins the loop order: walking base and seeking asset_tags
+        -- by its primary key beats scanning every tag link.
+        SELECT 'tag', (SELECT name FROM tags WHERE tags.id = asset_tags.tag_id), COUNT(*)
+        FROM base CROSS JOIN asset_tags ON asset_tags.asset_id = base.id
+        WHERE {others("tags")} GROUP BY asset_tags.tag_id
+        UNION ALL
+        -- One member's dominant color stands in for the whole Lab cell.
+        SELECT 'color', (SELECT json_extract(colors, '$[0]') FROM assets WHERE assets.id = sample), count
+        FROM (
+            SELECT min(id) AS sample, COUNT(*) AS count
+            FROM base WHERE {others("color")} AND color_bucket IS NOT NULL GROUP BY color_bucket
+        )
+        """,
+        params,
+    )
+    facets: Dict[str, List] = {"formats": [], "media_types": [], "tags": [], "folders": [], "colors": []}
+    total = 0
+    for row in rows:
+        kind = row["facet"]
+        if kind == "total":
+            total = row["count"]
+        elif kind == "format":
+            facets["formats"].append({"value": row["value"], "count": row["count"]})
+        elif kind == "media_type":
+            facets["media_types"].append({"value": row["value"], "count": row["count"]})
+        elif kind == "folder":
+            facets["folders"].append({"id": row["value"], "count": row["count"]})
+        elif kind == "tag":
+            facets["tags"].append({"value": row["value"], "count": row["count"]})
+        else:
+            facets["colors"].append({"hex": row["value"], "count": row["count"]})
+    for items in facets.values():
+        items.sort(key=lambda item: -item["count"])
+    facets["colors"] = facets["colors"][:MAX_COLOR_FACETS]
+    return {"total": total, **facets}
 
 
 @app.get("/assets/{asset_id}")
@@ -662,6 +1333,19 @@ def get_asset(asset_id: int):
     return asset_to_dict(row, tags_map)
 
 
+@app.post("/assets/{asset_id}/reprocess")
+def reprocess_asset(asset_id: int):
+    with transaction():
+        row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
+        if not row:
+            raise HTTPException(404, "asset not found")
+        if row["status"] != "failed":
+            raise HTTPException(409, f"asset is {row['status']}")
+        execute("UPDATE assets SET status = 'processing' WHERE id = ?", (asset_id,))
+        job_id = enqueue_job("ingest", asset_id)
+    return {"id": asset_id, "status": "processing", "job_id": job_id}
+
+
 @app.put("/assets/{asset_id}")
 def update_asset(asset_id: int, payload: Dict = Body(...)):
     row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
@@ -671,49 +1355,52 @@ def update_asset(asset_id: int, payload: Dict = Body(...)):
     folder_id = payload.get("folder_id", row["folder_id"])
     note = payload.get("note", row["note"])
     tags = payload.get("tags")
-    if tags is not None:
-        tag_names = set_asset_tags(asset_id, tags)
-    else:
-        tag_names = get_tags_for_assets([asset_id]).get(asset_id, [])
+    with transaction():
+        if tags is not None:
+            tag_names = set_asset_tags(asset_id, tags)
+        else:
+            tag_names = get_tags_for_assets([asset_id]).get(asset_id, [])
 
-    execute(
-        "UPDATE assets SET folder_id = ?, note = ? WHERE id = ?",
-        (folder_id, note, asset_id),
-    )
-    updated = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
+        execute(
+            "UPDATE assets SET folder_id = ?, note = ? WHERE id = ?",
+            (folder_id, note, asset_id),
+        )
+        updated = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
     return asset_to_dict(updated, {asset_id: tag_names})
 
 
 @app.delete("/assets/{asset_id}")
 def delete_asset(asset_id: int):
-    row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
-    if not row:
-        raise HTTPException(404, "asset not found")
-    try:
-        (STORAGE_DIR / row["stored_name"]).unlink(missing_ok=True)
-    except Exception:
-        pass
-    execute("DELETE FROM assets WHERE id = ?", (asset_id,))
+    with transaction():
+        row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
+        if not row:
+            raise HTTPException(404, "asset not found")
+        execute("DELETE FROM assets WHERE id = ?", (asset_id,))
+        # Drops the original, preview and thumbnails unless another asset shares them.
+        release_blobs()
     return {"status": "deleted"}
 
 
 @app.get("/assets/{asset_id}/download")
-def download_asset(asset_id: int):
+def download_asset(asset_id: int, request: Request):
     row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
     if not row:
         raise HTTPException(404, "asset not found")
     file_path = STORAGE_DIR / row["stored_name"]
     if not file_path.exists():
         raise HTTPException(404, "file missing")
-    return FileResponse(
+    # Keyed by asset id rather than content, so revalidate instead of caching forever.
+    return RangeFileResponse(
         file_path,
+        request.headers,
         media_type=row["mime"] or "application/octet-stream",
-        filename=row["filename"],
+        headers={"Content-Disposition": content_disposition(row["filename"])},
+        cache_control=REVALIDATE,
     )
 
 
 @app.get("/assets/{asset_id}/preview")
-def preview_asset(asset_id: int):
+def preview_asset(asset_id: int, request: Request):
     row = fetch_one("SELECT * FROM assets WHERE id = ?", (asset_id,))
     if not row:
         raise HTTPException(404, "asset not found")
@@ -722,28 +1409,31 @@ def preview_asset(asset_id: int):
     if preview_name:
         preview_path = STORAGE_DIR / preview_name
         if preview_path.exists():
-            return FileResponse(preview_path, media_type="image/jpeg")
+            return RangeFileResponse(preview_path, request.headers, media_type="image/jpeg", cache_control=REVALIDATE)
     stored_path = STORAGE_DIR / row["stored_name"]
     if not stored_path.exists():
         raise HTTPException(404, "file missing")
     if row_dict.get("media_type") == "raw" or row_dict.get("format") == "dng":
-        preview_img, _, _, _ = raw_preview(stored_path)
-        if not preview_img:
-            raise HTTPException(415, "preview not available")
-        preview_filename = f"{uuid4().hex}.jpg"
-        stored_parent = Path(row["stored_name"]).parent
-        if stored_parent and str(stored_parent) != ".":
-            preview_name = f"{sanitize_path(str(stored_parent))}/{preview_filename}"
-            preview_path = STORAGE_DIR / sanitize_path(str(stored_parent)) / preview_filename
-            preview_path.parent.mkdir(parents=True, exist_ok=True)
-        else:
-            preview_name = preview_filename
-            preview_path = STORAGE_DIR / preview_filename
-        preview_img.thumbnail((1600, 1600))
-        preview_img.save(preview_path, "JPEG", quality=90)
-        execute("UPDATE assets SET preview_name = ? WHERE id = ?", (preview_name, asset_id))
-        return FileResponse(preview_path, media_type="image/jpeg")
-    return FileResponse(stored_path, media_type=row["mime"] or "application/octet-stream")
+        staged = staging_target("jpg")
+        try:
+            if not run_in_process(write_raw_preview, stored_path, staged):
+                raise HTTPException(415, "preview not available")
+            preview_name = blob_name(row["content_hash"] or uuid4().hex, ".preview.jpg")
+            with transaction():
+                store_blob(staged, preview_name)
+                execute("UPDATE assets SET preview_name = ? WHERE id = ?", (preview_name, asset_id))
+                release_blobs()
+        finally:
+            staged.unlink(missing_ok=True)
+        return RangeFileResponse(
+            STORAGE_DIR / preview_name, request.headers, media_type="image/jpeg", cache_control=REVALIDATE
+        )
+    return RangeFileResponse(
+        stored_path,
+        request.headers,
+        media_type=row["mime"] or "application/octet-stream",
+        cache_control=REVALIDATE,
+    )
 
 
 @app.get("/smart-folders")
@@ -772,12 +1462,12 @@ def create_smart_folder(payload: Dict = Body(...)):
 
 
 @app.get("/smart-folders/{smart_id}/assets")
-def smart_folder_assets(smart_id: int):
+def smart_folder_assets(smart_id: int, request: Request):
     row = fetch_one("SELECT * FROM smart_folders WHERE id = ?", (smart_id,))
     if not row:
         raise HTTPException(404, "smart folder not found")
     query = from_json(row["query_json"]) or {}
-    return list_assets(**query)
+    return list_assets(request, **query)
 
 
 @app.get("/assets/{asset_id}/annotations")
@@ -800,8 +1490,8 @@ def create_annotation(asset_id: int, payload: Dict = Body(...)):
     data = payload.get("data") or {}
     created_at = now_iso()
     annotation_id = execute(
-        "INSERT INTO annotations(asset_id, kind, data_json, created_at) VALUES (?, ?, ?, ?)",
-        (asset_id, kind, json.dumps(data, ensure_ascii=True), created_at),
+        "INSERT INTO annotations(asset_id, kind, data_json, text, created_at) VALUES (?, ?, ?, ?, ?)",
+        (asset_id, kind, json.dumps(data, ensure_ascii=True), annotation_text(data), created_at),
     )
     return {"id": annotation_id, "asset_id": asset_id, "kind": kind, "data": data, "created_at": created_at}
 
@@ -0,0 +1,62 @@
+from pathlib import Path
+from typing import List
+from uuid import uuid4
+
+from .config import STORAGE_DIR, UPLOAD_STAGING_DIR
+from .db import after_commit, fetch_all, transaction
+
+BLOB_ROOT = "blobs"
+
+
+def blob_name(key: str, suffix: str = "") -> str:
+    # Two levels of two-hex-digit shards keep each directory to a few hundred
+    # entries even with millions of blobs.
+    return f"{BLOB_ROOT}/{key[:2]}/{key[2:4]}/{key}{suffix}"
+
+
+def staging_target(ext: str) -> Path:
+    UPLOAD_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    return UPLOAD_STAGING_DIR / (f"{uuid4().hex}.{ext}" if ext else uuid4().hex)
+
+
+def store_blob(staged: Path, name: str) -> None:
+    # Call inside the transaction that records the reference, so a concurrent
+    # release_blobs() cannot unlink the file between the rename and the commit.
+    target = STORAGE_DIR / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    staged.replace(target)
+
+
+def release_blobs() -> List[str]:
+    # Also called inside the transaction that dropped the references. The
+    # files are unlinked only after it commits, so a rollback never leaves
+    # rows pointing at deleted files.
+    rows = fetch_all("DELETE FROM blobs WHERE refcount <= 0 RETURNING name")
+    names = [row["name"] for row in rows]
+    if names:
+        after_commit(lambda: unlink_released(names))
+    return names
+
+
+def unlink_released(names: List[str]) -> None:
+    try:
+        # Holding the write lock keeps anyone from re-referencing a blob while
+        # we unlink it; one re-referenced since the release is kept.
+        with transaction():
+            live = {
+                row["name"]
+                for row in fetch_all(
+                    f"SELECT name FROM blobs WHERE name IN ({','.join('?' for _ in names)})",
+                    names,
+                )
+            }
+            for name in names:
+                if name in live:
+                    continue
+                try:
+                    (STORAGE_DIR / name).unlink(missing_ok=True)
+                except OSError as exc:
+                    print(f"[blobs] failed to remove {name}: {exc!r}")
+    except Exception as exc:
+        # The GC sweep reclaims whatever is left behind.
+        print(f"[blobs] failed to release {len(names)} blobs: {exc!r}")
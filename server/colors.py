@@ -0,0 +1,109 @@
+from typing import Iterable, List, Optional, Tuple
+
+# Palette entries indexed per asset; rtree row ids are asset_id * COLOR_SLOTS + slot
+# so an asset's rows can be found without scanning the tree.
+COLOR_SLOTS = 8
+# CIE76 distance: about 2.3 is a just-noticeable difference, 20 is "same hue family".
+DEFAULT_DELTA_E = 20.0
+# Edge of the Lab grid cells dominant colors are grouped into for facet counts.
+COLOR_BUCKET = 12.0
+
+# Linear sRGB to XYZ and the D65 reference white (utils.lab_array uses them too).
+SRGB_TO_XYZ = (
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041),
+)
+WHITE = (0.95047, 1.0, 1.08883)
+
+
+def parse_hex_color(value: str) -> Optional[Tuple[int, int, int]]:
+    value = value.strip().lstrip("#")
+    if len(value) != 6:
+        return None
+    try:
+        return (int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16))
+    except ValueError:
+        return None
+
+
+def _linear(channel: int) -> float:
+    c = channel / 255.0
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _f(t: float) -> float:
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(rgb: Tuple[int, int, int]) -> Tuple[float, float, float]:
+    linear = [_linear(c) for c in rgb]
+    fx, fy, fz = (
+        _f(sum(m * c for m, c in zip(row, linear)) / white) for row, white in zip(SRGB_TO_XYZ, WHITE)
+    )
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+def hex_to_lab(value: str) -> Optional[Tuple[float, float, float]]:
+    rgb = parse_hex_color(value) if isinstance(value, str) else None
+    return rgb_to_lab(rgb) if rgb else None
+
+
+def color_bucket(colors: Iterable[str]) -> Optional[int]:
+    """Lab grid cell of the first (dominant) color, packed into one integer."""
+    for value in colors or []:
+        lab = hex_to_lab(value)
+        if lab is not None:
+            l, a, b = (int((axis + 128) // COLOR_BUCKET) for axis in lab)
+            return (l * 100 + a) * 100 + b
+    return None
+
+
+def slot_ids(asset_id: int) -> List[int]:
+    return [asset_id * COLOR_SLOTS + slot for slot in range(COLOR_SLOTS)]
+
+
+def palette_rows(asset_id: int, colors: Iterable[str], coverage: Optional[List[float]] = None) -> List[Tuple]:
+    """Rows for the asset_colors rtree: one point (a zero-size box) per palette color.
+
+    The fourth dimension is the fraction of the image the color covers, 0 when
+    unknown (palettes extracted before coverage was recorded).
+    """
+    rows = []
+    coverage = coverage or []
+    for index, value in enumerate(colors or []):
+        lab = hex_to_lab(value)
+        if lab is None:
+            continue
+        l, a, b = lab
+        share = coverage[index] if index < len(coverage) and isinstance(coverage[index], (int, float)) else 0.0
+        rows.append((asset_id * COLOR_SLOTS + len(rows), l, l, a, a, b, b, share, share))
+        if len(rows) == COLOR_SLOTS:
+            break
+    return rows
+
+
+def color_filter(targets: Iterable[str], delta_e: float, min_coverage: Optional[float] = None) -> Tuple[str, List]:
+    # The rtree narrows each query color to a cube of side 2 * delta_e; the
+    # distance check then runs only on the candidates inside it. Both read the
+    # box columns (points, so min == max) and derive the asset from the row id:
+    # auxiliary columns would cost a second lookup per candidate.
+    selects = []
+    params: List = []
+    for value in targets:
+        lab = hex_to_lab(value)
+        if lab is None:
+            continue
+        l, a, b = lab
+        selects.append(
+            f"""
+                SELECT id / {COLOR_SLOTS} FROM asset_colors
+                WHERE l_min <= ? AND l_max >= ? AND a_min <= ? AND a_max >= ? AND b_min <= ? AND b_max >= ?
+                AND w_max >= ?
+                AND (l_min - ?) * (l_min - ?) + (a_min - ?) * (a_min - ?) + (b_min - ?) * (b_min - ?) <= ?"""
+        )
+        params.extend([l + delta_e, l - delta_e, a + delta_e, a - delta_e, b + delta_e, b - delta_e])
+        params.extend([min_coverage or 0.0, l, l, a, a, b, b, delta_e * delta_e])
+    if not selects:
+        return " AND 0", []
+    return f" AND assets.id IN ({' UNION'.join(selects)}\n            )", params
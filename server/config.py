@@ -1,9 +1,46 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-STORAGE_DIR = BASE_DIR / "storage"
+DATA_DIR = Path(os.getenv("CEAGLE_DATA_DIR", BASE_DIR / "data"))
+STORAGE_DIR = Path(os.getenv("CEAGLE_STORAGE_DIR", BASE_DIR / "storage"))
 DB_PATH = DATA_DIR / "eagle.db"
 
+# Sized for the default AnyIO threadpool (40 workers) that runs sync endpoints.
+DB_POOL_SIZE = int(os.getenv("CEAGLE_DB_POOL_SIZE", "40"))
+DB_MMAP_SIZE = int(os.getenv("CEAGLE_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_KB = int(os.getenv("CEAGLE_DB_CACHE_KB", str(16 * 1024)))
+
+# Decoding runs in a process pool; leave one core free for serving requests.
+INGEST_PROCESSES = int(os.getenv("CEAGLE_INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1))))
+INGEST_WORKERS = int(os.getenv("CEAGLE_INGEST_WORKERS", str(max(1, INGEST_PROCESSES))))
+MAX_UPLOAD_BYTES = int(os.getenv("CEAGLE_MAX_UPLOAD_BYTES", str(32 * 1024 ** 3)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Uploads and ingest outputs are staged inside STORAGE_DIR so moving them into
+# the blob store is a rename.
+UPLOAD_STAGING_DIR = STORAGE_DIR / ".uploads"
+RESUMABLE_CHUNK_SIZE = int(os.getenv("CEAGLE_RESUMABLE_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# Resumable uploads with no chunk written for this long are abandoned.
+UPLOAD_STALE_SECONDS = int(os.getenv("CEAGLE_UPLOAD_STALE_SECONDS", str(7 * 24 * 3600)))
+
+INGEST_MAX_ATTEMPTS = int(os.getenv("CEAGLE_INGEST_MAX_ATTEMPTS", "3"))
+# A failed job waits INGEST_RETRY_SECONDS, doubling per attempt, before a retry.
+INGEST_RETRY_SECONDS = float(os.getenv("CEAGLE_INGEST_RETRY_SECONDS", "30"))
+INGEST_RETRY_MAX_SECONDS = float(os.getenv("CEAGLE_INGEST_RETRY_MAX_SECONDS", "3600"))
+# Each process refreshes its running jobs' heartbeat; jobs whose heartbeat is
+# older than JOB_STALE_SECONDS belong to a dead process and are requeued.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("CEAGLE_JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("CEAGLE_JOB_STALE_SECONDS", "60"))
+
+# What to do when an upload's SHA-256 matches an existing asset:
+# "reject" (409), "link" (return the existing asset) or "share" (new asset row
+# reusing the stored file and its derivatives).
+DEDUP_POLICY = os.getenv("CEAGLE_DEDUP_POLICY", "share")
+
+# Storage GC: files younger than the grace period may belong to an ingest that
+# has not committed yet, so they are never treated as orphans.
+GC_FILES_PER_SECOND = float(os.getenv("CEAGLE_GC_FILES_PER_SECOND", "500"))
+GC_GRACE_SECONDS = int(os.getenv("CEAGLE_GC_GRACE_SECONDS", "3600"))
+
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
@@ -1,16 +1,117 @@
 import json
+import queue
 import sqlite3
-from typing import Iterable
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, Optional
 
-from .config import DB_PATH
+from .colors import COLOR_SLOTS, color_bucket, palette_rows
+from .config import DB_CACHE_KB, DB_MMAP_SIZE, DB_PATH, DB_POOL_SIZE
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_opened = 0
+_local = threading.local()
 
 
 def connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # Autocommit mode: statements commit on their own unless wrapped in an
+    # explicit BEGIN, so a pooled connection never carries an open transaction.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = {-DB_CACHE_KB}")
     return conn
 
 
+def _acquire() -> sqlite3.Connection:
+    global _opened
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _pool_lock:
+        if _opened < DB_POOL_SIZE:
+            conn = connect()
+            _opened += 1
+            return conn
+    return _pool.get()
+
+
+def _release(conn: sqlite3.Connection) -> None:
+    if conn.in_transaction:
+        conn.rollback()
+    _pool.put(conn)
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    # Every fetch/execute on this thread joins the transaction until it ends, and
+    # nested transaction() blocks fold into the outermost one. The binding is
+    # per thread, so async endpoints must not await inside the block.
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    conn = _acquire()
+    _local.conn = conn
+    _local.after_commit = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+        callbacks = _local.after_commit
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.conn = None
+        _local.after_commit = []
+        _release(conn)
+    for callback in callbacks:
+        callback()
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """Run callback once the current transaction commits, or now outside one.
+
+    Nothing runs if the transaction rolls back.
+    """
+    if getattr(_local, "conn", None) is None:
+        callback()
+    else:
+        _local.after_commit.append(callback)
+
+
+def close_pool() -> None:
+    global _opened
+    with _pool_lock:
+        while True:
+            try:
+                _pool.get_nowait().close()
+            except queue.Empty:
+                break
+        _opened = 0
+
+
 def init_db() -> None:
     conn = connect()
     cur = conn.cursor()
@@ -24,6 +125,8 @@ def init_db() -> None:
             parent_id INTEGER,
             path TEXT NOT NULL UNIQUE,
             created_at TEXT NOT NULL,
+            asset_count INTEGER NOT NULL DEFAULT 0,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY(parent_id) REFERENCES folders(id) ON DELETE SET NULL
         );
 
@@ -32,6 +135,8 @@ def init_db() -> None:
             filename TEXT NOT NULL,
             stored_name TEXT NOT NULL,
             preview_name TEXT,
+            thumb_small_name TEXT,
+            thumb_medium_name TEXT,
             media_type TEXT NOT NULL,
             mime TEXT,
             format TEXT,
@@ -42,13 +147,16 @@ def init_db() -> None:
             folder_id INTEGER,
             note TEXT,
             colors TEXT,
+            status TEXT NOT NULL DEFAULT 'ready',
+            content_hash TEXT,
             created_at TEXT NOT NULL,
             FOREIGN KEY(folder_id) REFERENCES folders(id) ON DELETE SET NULL
         );
 
         CREATE TABLE IF NOT EXISTS tags (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE
+            name TEXT NOT NULL UNIQUE,
+            asset_count INTEGER NOT NULL DEFAULT 0
         );
 
         CREATE TABLE IF NOT EXISTS asset_tags (
@@ -71,56 +179,439 @@ def init_db() -> None:
             asset_id INTEGER NOT NULL,
             kind TEXT NOT NULL,
             data_json TEXT NOT NULL,
+            text TEXT,
             created_at TEXT NOT NULL,
             FOREIGN KEY(asset_id) REFERENCES assets(id) ON DELETE CASCADE
         );
 
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            asset_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            owner TEXT,
+            heartbeat_at TEXT,
+            run_after TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(asset_id) REFERENCES assets(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            mime TEXT,
+            size_bytes INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            folder_id INTEGER,
+            relative_path TEXT,
+            tags TEXT,
+            note TEXT,
+            state TEXT NOT NULL DEFAULT 'open',
+            claimed_by TEXT,
+            claimed_at TEXT,
+            created_at TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS upload_chunks (
+            upload_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            PRIMARY KEY(upload_id, idx),
+            FOREIGN KEY(upload_id) REFERENCES uploads(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS gc_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            phase TEXT,
+            cursor TEXT,
+            dry_run INTEGER NOT NULL DEFAULT 1,
+            report TEXT,
+            reclaimed_files INTEGER NOT NULL DEFAULT 0,
+            reclaimed_bytes INTEGER NOT NULL DEFAULT 0
+        );
+
         CREATE INDEX IF NOT EXISTS idx_assets_format ON assets(format);
         CREATE INDEX IF NOT EXISTS idx_assets_media_type ON assets(media_type);
         CREATE INDEX IF NOT EXISTS idx_assets_folder ON assets(folder_id);
+        CREATE INDEX IF NOT EXISTS idx_assets_created ON assets(created_at DESC, id DESC);
         CREATE INDEX IF NOT EXISTS idx_tags_name ON tags(name);
         CREATE INDEX IF NOT EXISTS idx_asset_tags_tag ON asset_tags(tag_id);
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
         """
     )
     conn.commit()
-    try:
-        conn.execute("ALTER TABLE assets ADD COLUMN preview_name TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
+    for column in (
+        "preview_name TEXT",
+        "thumb_small_name TEXT",
+        "thumb_medium_name TEXT",
+        "status TEXT NOT NULL DEFAULT 'ready'",
+        "content_hash TEXT",
+        "color_coverage TEXT",
+        "color_bucket INTEGER",
+    ):
+        try:
+            conn.execute(f"ALTER TABLE assets ADD COLUMN {column}")
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+    for column in ("owner TEXT", "heartbeat_at TEXT", "run_after TEXT"):
+        try:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+    for column in ("state TEXT NOT NULL DEFAULT 'open'", "claimed_by TEXT", "claimed_at TEXT"):
+        try:
+            conn.execute(f"ALTER TABLE uploads ADD COLUMN {column}")
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+    # Not UNIQUE: the "share" dedup policy keeps several rows per blob.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_content_hash ON assets(content_hash)")
+    conn.commit()
+    init_search(conn)
+    init_blobs(conn)
+    init_colors(conn)
+    init_tag_counts(conn)
+    init_annotations(conn)
+    init_folder_counts(conn)
     conn.close()
 
 
+def init_search(conn: sqlite3.Connection) -> None:
+    # Trigram tokenization gives substring (and therefore prefix) matching that
+    # works for CJK text, which has no word boundaries for unicode61 to split on.
+    conn.executescript(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS assets_fts USING fts5(
+            filename, note, tags, annotations, tokenize = 'trigram'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS assets_fts_insert AFTER INSERT ON assets BEGIN
+            INSERT INTO assets_fts(rowid, filename, note, tags, annotations)
+            VALUES (NEW.id, NEW.filename, coalesce(NEW.note, ''), '', '');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS assets_fts_update AFTER UPDATE OF filename, note ON assets BEGIN
+            UPDATE assets_fts SET filename = NEW.filename, note = coalesce(NEW.note, '')
+            WHERE rowid = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS assets_fts_delete AFTER DELETE ON assets BEGIN
+            DELETE FROM assets_fts WHERE rowid = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS asset_tags_fts_insert AFTER INSERT ON asset_tags BEGIN
+            UPDATE assets_fts SET tags = (
+                SELECT coalesce(group_concat(tags.name, ' '), '') FROM asset_tags
+                JOIN tags ON tags.id = asset_tags.tag_id
+                WHERE asset_tags.asset_id = NEW.asset_id
+            ) WHERE rowid = NEW.asset_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS asset_tags_fts_delete AFTER DELETE ON asset_tags BEGIN
+            UPDATE assets_fts SET tags = (
+                SELECT coalesce(group_concat(tags.name, ' '), '') FROM asset_tags
+                JOIN tags ON tags.id = asset_tags.tag_id
+                WHERE asset_tags.asset_id = OLD.asset_id
+            ) WHERE rowid = OLD.asset_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS annotations_fts_insert AFTER INSERT ON annotations BEGIN
+            UPDATE assets_fts SET annotations = (
+                SELECT coalesce(group_concat(json_extract(data_json, '$.text'), ' '), '')
+                FROM annotations WHERE asset_id = NEW.asset_id
+            ) WHERE rowid = NEW.asset_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS annotations_fts_delete AFTER DELETE ON annotations BEGIN
+            UPDATE assets_fts SET annotations = (
+                SELECT coalesce(group_concat(json_extract(data_json, '$.text'), ' '), '')
+                FROM annotations WHERE asset_id = OLD.asset_id
+            ) WHERE rowid = OLD.asset_id;
+        END;
+        """
+    )
+    indexed = conn.execute("SELECT COUNT(*) FROM assets_fts").fetchone()[0]
+    total = conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+    if indexed != total:
+        conn.execute("DELETE FROM assets_fts")
+        conn.execute(
+            """
+            INSERT INTO assets_fts(rowid, filename, note, tags, annotations)
+            SELECT
+                assets.id,
+                assets.filename,
+                coalesce(assets.note, ''),
+                coalesce((
+                    SELECT group_concat(tags.name, ' ') FROM asset_tags
+                    JOIN tags ON tags.id = asset_tags.tag_id
+                    WHERE asset_tags.asset_id = assets.id
+                ), ''),
+                coalesce((
+                    SELECT group_concat(json_extract(data_json, '$.text'), ' ')
+                    FROM annotations WHERE annotations.asset_id = assets.id
+                ), '')
+            FROM assets
+            """
+        )
+    conn.commit()
+
+
+BLOB_COLUMNS = ("stored_name", "preview_name", "thumb_small_name", "thumb_medium_name")
+
+
+def init_blobs(conn: sqlite3.Connection) -> None:
+    # Every stored file an asset points at, original or derived, is reference
+    # counted so the last delete can reclaim it (see blobs.release_blobs).
+    existed = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'").fetchone()
+    increments = "\n".join(
+        f"""
+            INSERT INTO blobs(name, refcount) SELECT NEW.{column}, 1 WHERE NEW.{column} IS NOT NULL
+            ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1;"""
+        for column in BLOB_COLUMNS
+    )
+    decrements = "\n".join(
+        f"""
+            UPDATE blobs SET refcount = refcount - 1 WHERE name = OLD.{column};"""
+        for column in BLOB_COLUMNS
+    )
+    updates = "\n".join(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS blobs_assets_update_{column}
+        AFTER UPDATE OF {column} ON assets WHEN OLD.{column} IS NOT NEW.{column} BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE name = OLD.{column};
+            INSERT INTO blobs(name, refcount) SELECT NEW.{column}, 1 WHERE NEW.{column} IS NOT NULL
+            ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1;
+        END;"""
+        for column in BLOB_COLUMNS
+    )
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS blobs (
+            name TEXT NOT NULL PRIMARY KEY,
+            refcount INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refcount) WHERE refcount <= 0;
+
+        CREATE TRIGGER IF NOT EXISTS blobs_assets_insert AFTER INSERT ON assets BEGIN{increments}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS blobs_assets_delete AFTER DELETE ON assets BEGIN{decrements}
+        END;
+        {updates}
+        """
+    )
+    if not existed:
+        names = " UNION ALL ".join(f"SELECT {column} AS name FROM assets" for column in BLOB_COLUMNS)
+        conn.execute(
+            f"""
+            INSERT INTO blobs(name, refcount)
+            SELECT name, COUNT(*) FROM ({names}) WHERE name IS NOT NULL GROUP BY name
+            """
+        )
+    conn.commit()
+
+
+def init_colors(conn: sqlite3.Connection) -> None:
+    # Palette colors as CIELAB points in an rtree, so a color filter is a box
+    # lookup instead of decoding every asset's colors JSON. Rows are written by
+    # the code that sets assets.colors (app.index_asset_colors).
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(asset_colors)")]
+    if columns and "w_min" not in columns:
+        # Built before palettes carried coverage: rebuild with the extra dimension.
+        conn.execute("DROP TABLE asset_colors")
+    slots = ", ".join(f"OLD.id * {COLOR_SLOTS} + {slot}" for slot in range(COLOR_SLOTS))
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS asset_colors USING rtree(
+            id, l_min, l_max, a_min, a_max, b_min, b_max, w_min, w_max
+        );
+
+        CREATE TRIGGER IF NOT EXISTS asset_colors_assets_delete AFTER DELETE ON assets BEGIN
+            DELETE FROM asset_colors WHERE id IN ({slots});
+        END;
+        """
+    )
+    if "w_min" not in columns:
+        rows = conn.execute(
+            "SELECT id, colors, color_coverage FROM assets WHERE colors IS NOT NULL AND colors != '[]'"
+        ).fetchall()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO asset_colors VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                item
+                for row in rows
+                for item in palette_rows(row[0], from_json(row[1]) or [], from_json(row[2]))
+            ),
+        )
+        conn.commit()
+    # assets.color_bucket (dominant color's Lab cell, for facets) came later
+    # than the palettes themselves.
+    rows = conn.execute(
+        "SELECT id, colors FROM assets WHERE color_bucket IS NULL AND colors IS NOT NULL AND colors != '[]'"
+    ).fetchall()
+    if rows:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "UPDATE assets SET color_bucket = ? WHERE id = ?",
+            [(color_bucket(from_json(row[1]) or []), row[0]) for row in rows],
+        )
+    conn.commit()
+
+
+def init_tag_counts(conn: sqlite3.Connection) -> None:
+    # tags.asset_count follows asset_tags (asset deletes cascade into it and
+    # fire these too), so listing tags never aggregates the link table.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tags)")]
+    conn.execute("BEGIN")
+    if "asset_count" not in columns:
+        conn.execute("ALTER TABLE tags ADD COLUMN asset_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE tags SET asset_count = (SELECT COUNT(*) FROM asset_tags WHERE tag_id = tags.id)")
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS tags_count_insert AFTER INSERT ON asset_tags BEGIN
+            UPDATE tags SET asset_count = asset_count + 1 WHERE id = NEW.tag_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS tags_count_delete AFTER DELETE ON asset_tags BEGIN
+            UPDATE tags SET asset_count = asset_count - 1 WHERE id = OLD.tag_id;
+        END
+        """
+    )
+    conn.commit()
+
+
+def init_folder_counts(conn: sqlite3.Connection) -> None:
+    # folders.asset_count / size_bytes cover the assets directly in each
+    # folder; GET /folders rolls them up the path tree for subtree totals.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(folders)")]
+    conn.execute("BEGIN")
+    if "asset_count" not in columns:
+        conn.execute("ALTER TABLE folders ADD COLUMN asset_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE folders ADD COLUMN size_bytes INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            """
+            UPDATE folders SET (asset_count, size_bytes) = (
+                SELECT COUNT(*), coalesce(SUM(size_bytes), 0) FROM assets WHERE assets.folder_id = folders.id
+            )
+            """
+        )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS folders_count_insert AFTER INSERT ON assets
+        WHEN NEW.folder_id IS NOT NULL BEGIN
+            UPDATE folders SET asset_count = asset_count + 1, size_bytes = size_bytes + NEW.size_bytes
+            WHERE id = NEW.folder_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS folders_count_delete AFTER DELETE ON assets
+        WHEN OLD.folder_id IS NOT NULL BEGIN
+            UPDATE folders SET asset_count = asset_count - 1, size_bytes = size_bytes - OLD.size_bytes
+            WHERE id = OLD.folder_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS folders_count_update AFTER UPDATE OF folder_id, size_bytes ON assets
+        BEGIN
+            UPDATE folders SET asset_count = asset_count - 1, size_bytes = size_bytes - OLD.size_bytes
+            WHERE id = OLD.folder_id;
+            UPDATE folders SET asset_count = asset_count + 1, size_bytes = size_bytes + NEW.size_bytes
+            WHERE id = NEW.folder_id;
+        END
+        """
+    )
+    conn.commit()
+
+
+def annotation_text(data) -> Optional[str]:
+    """Normalized annotation text: the key /annotations groups by and filters match."""
+    if not isinstance(data, dict):
+        return None
+    text = str(data.get("text") or "").strip().lower()
+    return text or None
+
+
+def init_annotations(conn: sqlite3.Connection) -> None:
+    # annotations.text holds annotation_text(data_json) and annotation_counts
+    # the number of annotations per text, so neither the option list nor the
+    # filter decodes JSON.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(annotations)")]
+    conn.execute("BEGIN")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS annotation_counts (text TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    if "text" not in columns:
+        conn.execute("ALTER TABLE annotations ADD COLUMN text TEXT")
+        rows = conn.execute("SELECT id, data_json FROM annotations").fetchall()
+        conn.executemany(
+            "UPDATE annotations SET text = ? WHERE id = ?",
+            [(annotation_text(from_json(row[1])), row[0]) for row in rows],
+        )
+        conn.execute("DELETE FROM annotation_counts")
+        conn.execute(
+            """
+            INSERT INTO annotation_counts(text, count)
+            SELECT text, COUNT(*) FROM annotations WHERE text IS NOT NULL GROUP BY text
+            """
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_asset ON annotations(asset_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_text ON annotations(text, asset_id)")
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS annotation_counts_insert AFTER INSERT ON annotations
+        WHEN NEW.text IS NOT NULL BEGIN
+            INSERT INTO annotation_counts(text, count) VALUES (NEW.text, 1)
+            ON CONFLICT(text) DO UPDATE SET count = count + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS annotation_counts_delete AFTER DELETE ON annotations
+        WHEN OLD.text IS NOT NULL BEGIN
+            UPDATE annotation_counts SET count = count - 1 WHERE text = OLD.text;
+            DELETE FROM annotation_counts WHERE text = OLD.text AND count <= 0;
+        END
+        """
+    )
+    conn.commit()
+
+
 def fetch_all(query: str, params: Iterable = ()):  # type: ignore[override]
-    conn = connect()
-    cur = conn.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        return conn.execute(query, params).fetchall()
 
 
 def fetch_one(query: str, params: Iterable = ()):  # type: ignore[override]
-    conn = connect()
-    cur = conn.execute(query, params)
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with connection() as conn:
+        return conn.execute(query, params).fetchone()
 
 
 def execute(query: str, params: Iterable = ()):  # type: ignore[override]
-    conn = connect()
-    cur = conn.execute(query, params)
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
-    return last_id
+    with connection() as conn:
+        return conn.execute(query, params).lastrowid
 
 
 def execute_many(query: str, params_list: Iterable[Iterable]):
-    conn = connect()
-    conn.executemany(query, params_list)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.executemany(query, params_list)
+
+
+def now_iso(offset_seconds: float = 0) -> str:
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat()
 
 
 def to_json(value) -> str:
@@ -0,0 +1,253 @@
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+from .config import (
+    INGEST_MAX_ATTEMPTS,
+    INGEST_PROCESSES,
+    INGEST_RETRY_MAX_SECONDS,
+    INGEST_RETRY_SECONDS,
+    INGEST_WORKERS,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_STALE_SECONDS,
+)
+from .db import execute, fetch_all, now_iso, transaction
+
+_handlers: Dict[str, Callable[[int], None]] = {}
+_failure_handlers: Dict[str, Callable[[int], None]] = {}
+_heartbeats: List[Callable[[str, str], None]] = []
+_workers: List[threading.Thread] = []
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+_process_slots = threading.BoundedSemaphore(max(1, INGEST_PROCESSES))
+# Identifies this server process in the claims it holds.
+PROCESS_ID = uuid4().hex
+
+
+def register_heartbeat(beat: Callable[[str, str], None]) -> None:
+    """Call beat(process_id, now) on every heartbeat, to keep other claims alive."""
+    _heartbeats.append(beat)
+
+
+def register_handler(
+    kind: str,
+    handler: Callable[[int], None],
+    on_failure: Optional[Callable[[int], None]] = None,
+) -> None:
+    _handlers[kind] = handler
+    if on_failure is not None:
+        _failure_handlers[kind] = on_failure
+
+
+def enqueue_job(kind: str, asset_id: Optional[int] = None) -> int:
+    created_at = now_iso()
+    job_id = execute(
+        "INSERT INTO jobs(kind, asset_id, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+        (kind, asset_id, created_at, created_at),
+    )
+    _wakeup.set()
+    return job_id
+
+
+def claim_job():
+    # A single UPDATE ... RETURNING is atomic, so workers in other threads or
+    # other server processes can never claim the same job twice.
+    now = now_iso()
+    rows = fetch_all(
+        """
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, heartbeat_at = ?, updated_at = ?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND (run_after IS NULL OR run_after <= ?)
+            ORDER BY id LIMIT 1
+        )
+        RETURNING *
+        """,
+        (PROCESS_ID, now, now, now),
+    )
+    return rows[0] if rows else None
+
+
+def retry_delay(attempts: int) -> float:
+    return min(INGEST_RETRY_SECONDS * 2 ** max(attempts - 1, 0), INGEST_RETRY_MAX_SECONDS)
+
+
+def fail_job(job, error: str) -> None:
+    status = "queued" if job["attempts"] < INGEST_MAX_ATTEMPTS else "failed"
+    on_failure = _failure_handlers.get(job["kind"]) if status == "failed" else None
+    # Only the claim this row came from may settle the job: a reaper may have
+    # handed it to another worker since.
+    update = (
+        """
+        UPDATE jobs SET status = ?, error = ?, owner = NULL, run_after = ?, updated_at = ?
+        WHERE id = ? AND status = 'running' AND owner IS ?
+        RETURNING id
+        """,
+        (
+            status,
+            error,
+            now_iso(retry_delay(job["attempts"])) if status == "queued" else None,
+            now_iso(),
+            job["id"],
+            job["owner"],
+        ),
+    )
+    try:
+        with transaction():
+            settled = fetch_all(*update)
+            # Out of retries: let the owner settle the asset in the same commit.
+            if settled and on_failure is not None:
+                on_failure(job["asset_id"])
+    except Exception as failure_exc:
+        print(f"[jobs] failure handler for job {job['id']} failed: {failure_exc!r}")
+        fetch_all(*update)
+
+
+def run_job(job) -> None:
+    handler = _handlers.get(job["kind"])
+    try:
+        if handler is None:
+            raise RuntimeError(f"no handler for job kind {job['kind']!r}")
+        handler(job["asset_id"])
+    except Exception as exc:
+        print(f"[jobs] job {job['id']} ({job['kind']}) failed: {exc!r}")
+        fail_job(job, repr(exc))
+        return
+    execute(
+        """
+        UPDATE jobs SET status = 'done', error = NULL, owner = NULL, updated_at = ?
+        WHERE id = ? AND status = 'running' AND owner IS ?
+        """,
+        (now_iso(), job["id"], job["owner"]),
+    )
+
+
+def reap_stale_jobs() -> None:
+    # A running job whose owner stopped beating died with its process; jobs
+    # owned by live processes, including other servers, are left alone.
+    cutoff = now_iso(-JOB_STALE_SECONDS)
+    rows = fetch_all(
+        "SELECT * FROM jobs WHERE status = 'running' AND COALESCE(heartbeat_at, updated_at) < ?",
+        (cutoff,),
+    )
+    for job in rows:
+        print(f"[jobs] job {job['id']} ({job['kind']}) lost its worker {job['owner']}")
+        fail_job(job, "worker lost")
+
+
+def heartbeat_loop() -> None:
+    while not _stopping.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            now = now_iso()
+            execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                (now, PROCESS_ID),
+            )
+            for beat in _heartbeats:
+                beat(PROCESS_ID, now)
+            reap_stale_jobs()
+        except Exception as exc:
+            print(f"[jobs] heartbeat failed: {exc!r}")
+
+
+def worker_loop() -> None:
+    while not _stopping.is_set():
+        try:
+            job = claim_job()
+        except Exception as exc:
+            print(f"[jobs] claim failed: {exc!r}")
+            job = None
+        if job is None:
+            _wakeup.wait(timeout=1.0)
+            _wakeup.clear()
+            continue
+        run_job(job)
+
+
+def start_workers(count: int = INGEST_WORKERS) -> None:
+    if _workers:
+        return
+    _stopping.clear()
+    # Jobs a crashed process left running are requeued by the reaper once
+    # their heartbeat is stale.
+    thread = threading.Thread(target=heartbeat_loop, name="ingest-heartbeat", daemon=True)
+    thread.start()
+    _workers.append(thread)
+    for index in range(count):
+        thread = threading.Thread(target=worker_loop, name=f"ingest-worker-{index}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    _stopping.set()
+    _wakeup.set()
+    for thread in _workers:
+        thread.join(timeout=timeout)
+    _workers.clear()
+    shutdown_process_pool()
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    if INGEST_PROCESSES <= 0:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn rather than fork: the server process holds threads and open
+            # SQLite connections that must not be duplicated into children.
+            options = {}
+            if sys.version_info >= (3, 11):
+                # Recycle children so decoder leaks cannot grow without bound.
+                options["max_tasks_per_child"] = 100
+            _process_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                **options,
+            )
+        return _process_pool
+
+
+def run_in_process(func: Callable, *args):
+    # The semaphore caps in-flight decodes so callers block here instead of
+    # piling work into the pool's unbounded submission queue.
+    with _process_slots:
+        pool = get_process_pool()
+        if pool is None:
+            return func(*args)
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A child died (segfault, OOM kill) and took the whole pool with it.
+            # Replace the pool so later jobs are unaffected, and retry once.
+            discard_process_pool(pool)
+            pool = get_process_pool()
+            return pool.submit(func, *args).result()
+
+
+def discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    global _process_pool
+    with _process_pool_lock:
+        # Another thread may already have replaced the broken pool.
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def job_counts() -> Dict[str, int]:
+    rows = fetch_all("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")
+    return {row["status"]: row["count"] for row in rows}
@@ -0,0 +1,264 @@
+import gzip
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Mapping, Optional, Tuple
+from urllib.parse import quote
+from uuid import uuid4
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional support
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional support
+    zstandard = None
+
+READ_CHUNK_SIZE = 1024 * 1024
+MAX_RANGES = 16
+# Stored files never change once written: every write goes to a new name.
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def file_etag(path: os.PathLike, stat_result: os.stat_result) -> str:
+    key = f"{os.path.basename(path)}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    # If-None-Match wins over If-Modified-Since when both are sent (RFC 9110 13.2.2).
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag, weak=True)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def range_applies(request_headers: Mapping[str, str], etag: str, last_modified: str) -> bool:
+    if_range = request_headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', "W/")):
+        return etag_matches(if_range, etag, weak=False)
+    return if_range == last_modified
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+# Levels favour speed: list responses are compressed on every request.
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=5, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=4)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+# Server preference when the client weighs several encodings equally.
+ENCODING_PREFERENCE = ("zstd", "br", "gzip")
+MIN_COMPRESS_BYTES = 1024
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best = None
+    for name in ENCODING_PREFERENCE:
+        if name not in COMPRESSORS:
+            continue
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (name, weight)
+    return best[0] if best else None
+
+
+def encoded_response(body: bytes, accept_encoding: Optional[str], media_type: str = "application/json") -> Response:
+    """Wrap an already-serialized body, compressing it if the client accepts it."""
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        body = COMPRESSORS[encoding](body)
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def parse_ranges(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a Range header into sorted, coalesced inclusive (start, end) pairs.
+
+    Returns None when the header is absent or malformed (serve the whole file,
+    as RFC 9110 allows) and an empty list when no range is satisfiable (416).
+    """
+    if not header:
+        return None
+    unit, _, value = header.partition("=")
+    if unit.strip().lower() != "bytes" or not value:
+        return None
+    ranges: List[Tuple[int, int]] = []
+    try:
+        for spec in value.split(","):
+            start_str, sep, end_str = spec.strip().partition("-")
+            if not sep:
+                return None
+            if start_str == "":
+                length = int(end_str)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start_str)
+            end = int(end_str) if end_str else None
+            if start < 0 or (end is not None and end < start):
+                return None
+            if start < size:
+                ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    except ValueError:
+        return None
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class RangeFileResponse(Response):
+    """Serve a file, or byte ranges of it, without buffering it whole.
+
+    Each chunk is read with os.pread in a worker thread straight from the
+    shared descriptor. Several ranges are sent as multipart/byteranges.
+    Conditional requests (If-None-Match, If-Modified-Since, If-Range) are
+    answered from the file's stat.
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        request_headers: Optional[Mapping[str, str]] = None,
+        media_type: str = "application/octet-stream",
+        headers: Optional[Mapping[str, str]] = None,
+        stat_result: Optional[os.stat_result] = None,
+        cache_control: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        self.parts: List[Tuple[bytes, int, int]] = []
+        self.trailer = b""
+        stat_result = stat_result or os.stat(path)
+        size = stat_result.st_size
+        request_headers = request_headers or {}
+        headers = dict(headers or {})
+        etag = file_etag(path, stat_result)
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        headers.update({"ETag": etag, "Last-Modified": last_modified})
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+
+        if not_modified(request_headers, etag, stat_result.st_mtime):
+            self.status_code = 304
+            self.media_type = None
+            self.init_headers(headers)
+            return
+
+        range_header = request_headers.get("range") if range_applies(request_headers, etag, last_modified) else None
+        ranges = parse_ranges(range_header, size)
+        extra = {"Accept-Ranges": "bytes"}
+
+        if ranges is None:
+            self.status_code = 200
+            self.parts.append((b"", 0, size))
+            length = size
+            content_type = media_type
+        elif not ranges:
+            self.status_code = 416
+            length = 0
+            content_type = media_type
+            extra["Content-Range"] = f"bytes */{size}"
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.parts.append((b"", start, end - start + 1))
+            length = end - start + 1
+            content_type = media_type
+            extra["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            boundary = uuid4().hex
+            self.status_code = 206
+            for start, end in ranges:
+                preamble = (
+                    f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                # __call__ prefixes every part after the first with the CRLF
+                # that, like the trailer's, starts a multipart delimiter.
+                self.parts.append((preamble, start, end - start + 1))
+            self.trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            length = sum(len(p) + count for p, _, count in self.parts) + 2 * (len(self.parts) - 1) + len(self.trailer)
+            content_type = f"multipart/byteranges; boundary={boundary}"
+
+        self.init_headers({**headers, **extra, "Content-Length": str(length), "Content-Type": content_type})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or not self.parts:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        with open(self.path, "rb", buffering=0) as handle:
+            fd = handle.fileno()
+            for index, (preamble, offset, count) in enumerate(self.parts):
+                prefix = (b"\r\n" if index else b"") + preamble
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                end = offset + count
+                while offset < end:
+                    chunk = await anyio.to_thread.run_sync(os.pread, fd, min(READ_CHUNK_SIZE, end - offset), offset)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": self.trailer, "more_body": False})
@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import GC_FILES_PER_SECOND, GC_GRACE_SECONDS, STORAGE_DIR, UPLOAD_STAGING_DIR, UPLOAD_STALE_SECONDS
+from .db import execute, fetch_all, fetch_one, from_json, init_db, now_iso, to_json, transaction
+
+BATCH_SIZE = 500
+MISSING_REPORT_LIMIT = 1000
+PHASES = ("staging", "files", "assets")
+
+_running = threading.Lock()
+
+
+class GCBusy(Exception):
+    pass
+
+
+def empty_report(dry_run: bool) -> Dict:
+    return {
+        "dry_run": dry_run,
+        "started_at": now_iso(),
+        "finished_at": None,
+        "files_scanned": 0,
+        "bytes_scanned": 0,
+        "orphan_files": 0,
+        "orphan_bytes": 0,
+        "stale_uploads": 0,
+        "reclaimed_files": 0,
+        "reclaimed_bytes": 0,
+        "assets_checked": 0,
+        "missing_assets": 0,
+        "missing_asset_ids": [],
+    }
+
+
+def staging_rel() -> Optional[str]:
+    try:
+        return UPLOAD_STAGING_DIR.relative_to(STORAGE_DIR).as_posix()
+    except ValueError:
+        return None
+
+
+def iter_storage(root: Path, after: Optional[str], prefix: str = "") -> Iterator[Tuple[str, os.DirEntry]]:
+    try:
+        with os.scandir(root) as scan:
+            entries = list(scan)
+    except FileNotFoundError:
+        return
+    # Directories sort as "name/" so files come out in plain string order of
+    # their relative path, which is what lets a saved cursor resume the walk.
+    entries.sort(key=lambda entry: entry.name + "/" if entry.is_dir(follow_symlinks=False) else entry.name)
+    skip = staging_rel()
+    for entry in entries:
+        rel = prefix + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if rel == skip:
+                continue
+            if after is None or rel + "/" > after or after.startswith(rel + "/"):
+                yield from iter_storage(Path(entry.path), after, rel + "/")
+        elif entry.is_file(follow_symlinks=False) and (after is None or rel > after):
+            yield rel, entry
+
+
+def referenced_names(names: List[str]) -> set:
+    if not names:
+        return set()
+    placeholders = ",".join("?" for _ in names)
+    rows = fetch_all(f"SELECT name FROM blobs WHERE refcount > 0 AND name IN ({placeholders})", names)
+    return {row["name"] for row in rows}
+
+
+def prune_empty_dirs(path: Path) -> None:
+    parent = path.parent
+    while parent != STORAGE_DIR and STORAGE_DIR in parent.parents:
+        try:
+            parent.rmdir()
+        except OSError:
+            return
+        parent = parent.parent
+
+
+def sweep_files(batch: List[Tuple[str, os.DirEntry]], report: Dict, dry_run: bool) -> None:
+    referenced = referenced_names([rel for rel, _ in batch])
+    cutoff = time.time() - GC_GRACE_SECONDS
+    candidates: List[Tuple[str, int]] = []
+    for rel, entry in batch:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        report["files_scanned"] += 1
+        report["bytes_scanned"] += stat.st_size
+        if rel in referenced or stat.st_mtime > cutoff:
+            continue
+        report["orphan_files"] += 1
+        report["orphan_bytes"] += stat.st_size
+        candidates.append((rel, stat.st_size))
+    if dry_run or not candidates:
+        return
+    with transaction():
+        # Re-check under the write lock: an upload may have claimed the blob
+        # since the first lookup.
+        names = [rel for rel, _ in candidates]
+        still_referenced = referenced_names(names)
+        for rel, size in candidates:
+            if rel in still_referenced:
+                continue
+            path = STORAGE_DIR / rel
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            report["reclaimed_files"] += 1
+            report["reclaimed_bytes"] += size
+            prune_empty_dirs(path)
+        execute(
+            f"DELETE FROM blobs WHERE refcount <= 0 AND name IN ({','.join('?' for _ in names)})",
+            names,
+        )
+
+
+def sweep_staging(report: Dict, dry_run: bool) -> None:
+    # Staged files are keyed by upload id or are ingest temporaries; anything
+    # not owned by a live resumable upload is debris from a failed write.
+    live = {row["id"] for row in fetch_all("SELECT id FROM uploads")}
+    grace_cutoff = time.time() - GC_GRACE_SECONDS
+    stale_cutoff = time.time() - UPLOAD_STALE_SECONDS
+    try:
+        with os.scandir(UPLOAD_STAGING_DIR) as scan:
+            entries = [entry for entry in scan if entry.is_file(follow_symlinks=False)]
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        upload_id = entry.name.split(".", 1)[0]
+        report["files_scanned"] += 1
+        report["bytes_scanned"] += stat.st_size
+        if upload_id in live:
+            # Every PUT touches the staging file, so its mtime is the last activity.
+            if stat.st_mtime > stale_cutoff:
+                continue
+            report["stale_uploads"] += 1
+            if not dry_run:
+                execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        elif stat.st_mtime > grace_cutoff:
+            continue
+        report["orphan_files"] += 1
+        report["orphan_bytes"] += stat.st_size
+        if dry_run:
+            continue
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            continue
+        report["reclaimed_files"] += 1
+        report["reclaimed_bytes"] += stat.st_size
+
+
+def check_assets(after: int, report: Dict) -> Optional[int]:
+    rows = fetch_all("SELECT id, stored_name FROM assets WHERE id > ? ORDER BY id LIMIT ?", (after, BATCH_SIZE))
+    for row in rows:
+        report["assets_checked"] += 1
+        if not (STORAGE_DIR / row["stored_name"]).is_file():
+            report["missing_assets"] += 1
+            if len(report["missing_asset_ids"]) < MISSING_REPORT_LIMIT:
+                report["missing_asset_ids"].append(row["id"])
+    return rows[-1]["id"] if rows else None
+
+
+def load_state():
+    return fetch_one("SELECT * FROM gc_state WHERE id = 1")
+
+
+def save_state(
+    phase: Optional[str],
+    cursor: Optional[str],
+    dry_run: bool,
+    report: Dict,
+    reclaimed_files: int = 0,
+    reclaimed_bytes: int = 0,
+) -> None:
+    # reclaimed_* columns are lifetime totals across passes; the report only
+    # covers the current (or last finished) pass.
+    execute(
+        """
+        INSERT INTO gc_state(id, phase, cursor, dry_run, report, reclaimed_files, reclaimed_bytes)
+        VALUES (1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET phase = excluded.phase, cursor = excluded.cursor,
+            dry_run = excluded.dry_run, report = excluded.report,
+            reclaimed_files = reclaimed_files + excluded.reclaimed_files,
+            reclaimed_bytes = reclaimed_bytes + excluded.reclaimed_bytes
+        """,
+        (phase, cursor, int(dry_run), to_json(report), reclaimed_files, reclaimed_bytes),
+    )
+
+
+def gc_status() -> Dict:
+    state = load_state()
+    if not state:
+        return {"phase": None, "running": _running.locked(), "report": None, "reclaimed_files": 0, "reclaimed_bytes": 0}
+    return {
+        "phase": state["phase"],
+        "cursor": state["cursor"],
+        "running": _running.locked(),
+        "report": from_json(state["report"]),
+        "reclaimed_files": state["reclaimed_files"],
+        "reclaimed_bytes": state["reclaimed_bytes"],
+    }
+
+
+def run_gc(
+    dry_run: bool = True,
+    max_items: Optional[int] = None,
+    rate: float = GC_FILES_PER_SECOND,
+    restart: bool = False,
+) -> Dict:
+    """Advance the storage/database reconciliation by up to max_items entries.
+
+    Progress is saved after every batch, so a run cut short by max_items, a
+    crash or a restart picks up where it stopped. A pass started in dry-run
+    mode only resumes as dry-run, and vice versa.
+    """
+    if not _running.acquire(blocking=False):
+        raise GCBusy()
+    try:
+        state = load_state()
+        if restart or not state or not state["phase"] or bool(state["dry_run"]) != dry_run:
+            phase, cursor, report = PHASES[0], None, empty_report(dry_run)
+        else:
+            phase, cursor, report = state["phase"], state["cursor"], from_json(state["report"])
+        budget = max_items if max_items and max_items > 0 else None
+
+        while phase and (budget is None or budget > 0):
+            started = time.monotonic()
+            before = report["files_scanned"] + report["assets_checked"]
+            files_before = report["reclaimed_files"]
+            bytes_before = report["reclaimed_bytes"]
+            if phase == "staging":
+                sweep_staging(report, dry_run)
+                phase, cursor = "files", None
+            elif phase == "files":
+                batch: List[Tuple[str, os.DirEntry]] = []
+                for item in iter_storage(STORAGE_DIR, cursor):
+                    batch.append(item)
+                    if len(batch) >= min(BATCH_SIZE, budget or BATCH_SIZE):
+                        break
+                if batch:
+                    sweep_files(batch, report, dry_run)
+                    cursor = batch[-1][0]
+                else:
+                    phase, cursor = "assets", "0"
+            else:
+                last_id = check_assets(int(cursor or 0), report)
+                if last_id is None:
+                    phase, cursor = None, None
+                    report["finished_at"] = now_iso()
+                else:
+                    cursor = str(last_id)
+            done = report["files_scanned"] + report["assets_checked"] - before
+            save_state(
+                phase,
+                cursor,
+                dry_run,
+                report,
+                report["reclaimed_files"] - files_before,
+                report["reclaimed_bytes"] - bytes_before,
+            )
+            if budget is not None:
+                budget -= done
+            # Pace whole batches rather than single files to keep the sleep count low.
+            if rate > 0 and phase:
+                delay = done / rate - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        _running.release()
+    return gc_status()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reconcile STORAGE_DIR against the database.")
+    parser.add_argument("--apply", action="store_true", help="delete orphans (default is a dry run)")
+    parser.add_argument("--max-items", type=int, default=0, help="stop after this many files/rows (0 = whole pass)")
+    parser.add_argument("--rate", type=float, default=GC_FILES_PER_SECOND, help="files per second, 0 = unthrottled")
+    parser.add_argument("--restart", action="store_true", help="discard saved progress and start a new pass")
+    args = parser.parse_args()
+    init_db()
+    status = run_gc(dry_run=not args.apply, max_items=args.max_items, rate=args.rate, restart=args.restart)
+    print(json.dumps(status, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
+import hashlib
 import mimetypes
 import shutil
 import subprocess
 import json
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageOps
 
 try:
     import pillow_heif
@@ -14,10 +15,29 @@ try:
 except ImportError:  # pragma: no cover - optional support
     pillow_heif = None
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional support
+    np = None
+
+from .colors import SRGB_TO_XYZ, WHITE
+
+EXIF_ORIENTATION = 0x0112
 IMAGE_EXTS = {"jpg", "jpeg", "png", "webp", "bmp", "tiff", "tif", "heic"}
 RAW_EXTS = {"dng"}
 VIDEO_EXTS = {"mp4", "mov", "mkv", "webm", "avi"}
 AUDIO_EXTS = {"mp3", "wav", "aac", "flac", "ogg", "m4a"}
+# Longest side of each thumbnail. "small" covers a default grid tile
+# (about 310 px tall, up to ~560 px wide) at 1x; web/src/App.jsx mirrors these.
+THUMB_SIZES = {"small": 640, "medium": 1024}
+# Palettes are extracted from a buffer this size (longest side), seeded with
+# PALETTE_SEEDS median-cut boxes; clusters closer than PALETTE_MERGE_DELTA_E
+# (CIE76) merge and those under PALETTE_MIN_COVERAGE of the pixels are dropped.
+PALETTE_SAMPLE_SIZE = 64
+PALETTE_SEEDS = 8
+PALETTE_ITERATIONS = 8
+PALETTE_MERGE_DELTA_E = 12.0
+PALETTE_MIN_COVERAGE = 0.02
 
 
 def sniff_mime(filename: str, provided: Optional[str] = None) -> Optional[str]:
@@ -48,48 +68,129 @@ def detect_media_type(mime: Optional[str], ext: str) -> str:
     return "file"
 
 
-def image_metadata(path: Path) -> Tuple[Optional[int], Optional[int], List[str]]:
-    if path.suffix.lower() == ".heic" and pillow_heif is not None:
-        try:
-            heif_file = pillow_heif.read_heif(str(path))
-            img = Image.frombytes(
-                heif_file.mode,
-                heif_file.size,
-                heif_file.data,
-                "raw",
-                heif_file.mode,
-                heif_file.stride,
-            ).convert("RGB")
-            width, height = img.size
-            colors = extract_colors(img)
-            return width, height, colors
-        except Exception as exc:
-            print(f"[image-metadata] failed to decode {path.name}: {exc!r}")
-            return None, None, []
-    try:
-        with Image.open(path) as img:
-            img = img.convert("RGB")
-            width, height = img.size
-            colors = extract_colors(img)
-            return width, height, colors
-    except Exception as exc:
-        print(f"[image-metadata] failed to decode {path.name}: {exc!r}")
-        return None, None, []
+def decode_heif(path: Path) -> Image.Image:
+    if pillow_heif is None:
+        return Image.open(path).convert("RGB")
+    heif_file = pillow_heif.read_heif(str(path))
+    return Image.frombytes(
+        heif_file.mode,
+        heif_file.size,
+        heif_file.data,
+        "raw",
+        heif_file.mode,
+        heif_file.stride,
+    ).convert("RGB")
+
+
+def load_image(path: Path, size: int) -> Tuple[Image.Image, int, int]:
+    """Decode an image once, at no more than the resolution a size px rendition needs.
+
+    Width and height are read from the header, with EXIF orientation applied.
+    JPEGs decode at the smallest DCT scale that still covers size (draft);
+    other formats decode in full.
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        img.draft("RGB", (size, size))
+        return ImageOps.exif_transpose(img), width, height
 
 
-def raw_preview(path: Path) -> Tuple[Optional[Image.Image], Optional[int], Optional[int], List[str]]:
+def raw_preview(path: Path) -> Tuple[Optional[Image.Image], Optional[int], Optional[int], List[Tuple[str, float]]]:
     try:
         import rawpy
         with rawpy.imread(str(path)) as raw:
-            rgb = raw.postprocess()
+            # Half-size skips demosaicing and still leaves a camera frame well
+            # above the preview size; the real dimensions come from the header.
+            rgb = raw.postprocess(half_size=True)
+            width, height = raw.sizes.width, raw.sizes.height
+            if raw.sizes.flip in (5, 6):
+                width, height = height, width
         img = Image.fromarray(rgb).convert("RGB")
-        width, height = img.size
-        colors = extract_colors(img)
-        return img, width, height, colors
+        palette = extract_palette(img)
+        return img, width, height, palette
     except Exception:
         return None, None, None, []
 
 
+def save_preview(img: Image.Image, output: Path) -> None:
+    img.thumbnail((1600, 1600))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    img.save(output, "JPEG", quality=90)
+
+
+def write_raw_preview(path: Path, output: Path) -> bool:
+    preview_img, _, _, _ = raw_preview(path)
+    if not preview_img:
+        return False
+    save_preview(preview_img, output)
+    return True
+
+
+def render_derivatives(
+    path: Path,
+    media_type: str,
+    ext: str,
+    preview_path: Path,
+    thumb_paths: Dict[str, Path],
+) -> Dict:
+    # Runs in the ingest process pool: takes and returns only picklable values
+    # and writes its outputs straight to the given paths.
+    result: Dict = {
+        "width": None,
+        "height": None,
+        "colors": [],
+        "color_coverage": [],
+        "duration_ms": None,
+        "preview": False,
+        "thumbs": [],
+    }
+    thumb_source = None
+    palette: List[Tuple[str, float]] = []
+    if media_type in {"image", "gif"}:
+        # One (reduced) decode feeds the palette, the preview and the thumbnails.
+        try:
+            if ext == "heic":
+                img = decode_heif(path)
+                result["width"], result["height"] = img.size
+            else:
+                img, result["width"], result["height"] = load_image(path, max(THUMB_SIZES.values()))
+            palette = extract_palette(img)
+            if ext == "heic":
+                save_preview(img, preview_path)
+                result["preview"] = True
+            thumb_source = img
+        except Exception as exc:
+            print(f"[image-metadata] failed to decode {path.name}: {exc!r}")
+    elif media_type == "raw":
+        preview_img, result["width"], result["height"], palette = raw_preview(path)
+        if preview_img:
+            save_preview(preview_img, preview_path)
+            result["preview"] = True
+            thumb_source = preview_img
+    elif media_type == "video":
+        result["width"], result["height"], duration_ms = ffprobe_metadata(path)
+        result["duration_ms"] = int(duration_ms) if duration_ms else None
+        if ffmpeg_thumbnail(path, preview_path):
+            result["preview"] = True
+            thumb_source = preview_path
+    result["colors"] = [color for color, _ in palette]
+    result["color_coverage"] = [coverage for _, coverage in palette]
+
+    if thumb_source is not None:
+        try:
+            if isinstance(thumb_source, Path):
+                with Image.open(thumb_source) as img:
+                    written = write_thumbnails(img, thumb_paths)
+            else:
+                written = write_thumbnails(thumb_source, thumb_paths)
+            result["thumbs"] = sorted(written)
+        except Exception as exc:
+            print(f"[thumbnail] failed to render thumbnails for {path.name}: {exc!r}")
+    return result
+
+
 def is_raw_extension(ext: str) -> bool:
     return ext.lower() in RAW_EXTS
 
@@ -170,20 +271,139 @@ def ffmpeg_thumbnail(path: Path, output: Path) -> bool:
         return False
 
 
-def extract_colors(img: Image.Image, max_colors: int = 5) -> List[str]:
+def write_thumbnails(img: Image.Image, targets: Dict[str, Path]) -> Dict[str, Path]:
+    has_alpha = "A" in img.getbands() or "transparency" in img.info
+    thumb = img.convert("RGBA" if has_alpha else "RGB")
+    written: Dict[str, Path] = {}
+    # Largest first, so each smaller rendition is downscaled from the previous one.
+    for label, size in sorted(THUMB_SIZES.items(), key=lambda item: item[1], reverse=True):
+        target = targets.get(label)
+        if target is None:
+            continue
+        thumb.thumbnail((size, size), reducing_gap=2.0)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            thumb.save(target, "WEBP", quality=80, method=4)
+            written[label] = target
+        except Exception as exc:
+            print(f"[thumbnail] failed to write {target.name}: {exc!r}")
+    return written
+
+
+def extract_palette(img: Image.Image, max_colors: int = 5) -> List[Tuple[str, float]]:
+    """Dominant colors of an image, most prominent first, with the share of pixels each covers.
+
+    Pillow's median cut seeds the clusters; with NumPy they are refined by
+    k-means in CIELAB, so pixels group by perceived rather than RGB distance.
+    """
     small = img.copy()
-    small.thumbnail((64, 64))
-    colors = small.getcolors(64 * 64)
-    if not colors:
-        return []
-    colors.sort(key=lambda item: item[0], reverse=True)
-    top = [rgb_to_hex(color[1]) for color in colors[:max_colors]]
-    return top
+    small.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+    if small.mode != "RGB":
+        small = small.convert("RGB")
+    quantized = small.quantize(PALETTE_SEEDS, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette() or []
+    if np is not None:
+        clusters = refine_palette(np.asarray(small), np.asarray(quantized))
+    else:
+        counts = quantized.getcolors(PALETTE_SEEDS) or []
+        total = sum(count for count, _ in counts) or 1
+        clusters = [(count / total, tuple(palette[index * 3 : index * 3 + 3])) for count, index in counts]
+    clusters.sort(key=lambda item: item[0], reverse=True)
+    return [
+        (rgb_to_hex(rgb), round(coverage, 3)) for coverage, rgb in clusters if coverage >= PALETTE_MIN_COVERAGE
+    ][:max_colors]
+
+
+def lab_array(rgb: "np.ndarray") -> "np.ndarray":
+    c = rgb / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.asarray(SRGB_TO_XYZ, dtype=np.float32).T / np.asarray(WHITE, dtype=np.float32)
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def cluster_means(values: "np.ndarray", labels: "np.ndarray", previous: "np.ndarray") -> "np.ndarray":
+    k = len(previous)
+    counts = np.bincount(labels, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=values[:, c], minlength=k) for c in range(3)], axis=1)
+    # An emptied cluster keeps its last center rather than collapsing to black.
+    return np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], previous)
+
+
+def refine_palette(rgb: "np.ndarray", seeds: "np.ndarray") -> List[Tuple[float, Tuple[int, int, int]]]:
+    pixels = rgb.reshape(-1, 3).astype(np.float32)
+    lab = lab_array(pixels)
+    labels = seeds.reshape(-1).astype(np.intp)
+    k = int(labels.max()) + 1
+    centers = cluster_means(lab, labels, np.zeros((k, 3)))
+    for _ in range(PALETTE_ITERATIONS):
+        distances = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        assigned = distances.argmin(axis=1)
+        if np.array_equal(assigned, labels):
+            break
+        labels = assigned
+        centers = cluster_means(lab, labels, centers)
+    counts = np.bincount(labels, minlength=k)
+    colors = cluster_means(pixels, labels, np.zeros((k, 3)))
+    merged: List[list] = []
+    for index in np.argsort(-counts, kind="stable"):
+        if not counts[index]:
+            break
+        for entry in merged:
+            if ((entry[0] - centers[index]) ** 2).sum() <= PALETTE_MERGE_DELTA_E**2:
+                entry[1] += int(counts[index])
+                break
+        else:
+            merged.append([centers[index], int(counts[index]), colors[index]])
+    return [
+        (count / labels.size, tuple(int(round(float(c))) for c in color)) for _, count, color in merged
+    ]
 
 
 def rgb_to_hex(rgb: Tuple[int, int, int]) -> str:
     return "#{:02x}{:02x}{:02x}".format(rgb[0], rgb[1], rgb[2])
 
 
+class UploadTooLarge(Exception):
+    pass
+
+
+def copy_and_hash(src: BinaryIO, dest: Path, max_bytes: int = 0, chunk_size: int = 1024 * 1024) -> Tuple[int, str]:
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with dest.open("wb") as buffer:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLarge(dest.name)
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_at(path: Path, offset: int, data: bytes) -> None:
+    with path.open("r+b") as handle:
+        handle.seek(offset)
+        handle.write(data)
+
+
 def file_extension(filename: str) -> str:
     return Path(filename).suffix.lstrip(".").lower()
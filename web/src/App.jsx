@@ -7,10 +7,14 @@ import {
   deleteAsset,
   deleteFolder,
   downloadUrl,
+  ensureFolders,
   fetchAnnotations,
   fetchAnnotationOptions,
+  fetchAssetPage,
   fetchAssets,
+  fetchFacets,
   fetchFolders,
+  fetchJobs,
   fetchSmartFolders,
   fetchTags,
   mediaUrl,
@@ -32,6 +36,16 @@ const emptyForm = {
   color: ""
 };
 
+// Longest side of the server's thumbnail renditions (THUMB_SIZES in server/utils.py).
+const THUMB_SIZES = { small: 640, medium: 1024 };
+
+// Pixel width of a rendition bounded to size on its longest side, never upscaled.
+const thumbWidth = (asset, size) => {
+  if (!asset.width || !asset.height) return size;
+  const scale = Math.min(1, size / Math.max(asset.width, asset.height));
+  return Math.max(1, Math.round(asset.width * scale));
+};
+
 const resolveTheme = (value) => {
   if (value !== "system") return value;
   if (typeof window === "undefined") return "light";
@@ -110,6 +124,7 @@ function isFileDrag(event) {
 
 export default function App() {
   const [assets, setAssets] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [folders, setFolders] = useState([]);
   const [tags, setTags] = useState([]);
   const [smartFolders, setSmartFolders] = useState([]);
@@ -148,6 +163,7 @@ export default function App() {
   const [selectedColors, setSelectedColors] = useState([]);
   const [selectedNotes, setSelectedNotes] = useState([]);
   const [tagQuery, setTagQuery] = useState("");
+  const [tagSuggestions, setTagSuggestions] = useState(null);
   const [formatQuery, setFormatQuery] = useState("");
   const [showTagPopover, setShowTagPopover] = useState(false);
   const [showFormatPopover, setShowFormatPopover] = useState(false);
@@ -176,6 +192,7 @@ export default function App() {
   });
   const [annotationOptions, setAnnotationOptions] = useState([]);
   const [colorGroups, setColorGroups] = useState([]);
+  const [formatOptions, setFormatOptions] = useState([]);
   const [recentAnnotations, setRecentAnnotations] = useState(() => {
     try {
       const raw = localStorage.getItem("recentAnnotations");
@@ -220,6 +237,9 @@ export default function App() {
   const themeMenuRef = useRef(null);
   const longPressTimer = useRef(null);
   const longPressTriggered = useRef(false);
+  const assetRequest = useRef(0);
+  const loadingMore = useRef(false);
+  const loadMoreRef = useRef(null);
 
   const loadMeta = async () => {
     const [folderData, tagData, smartData, annotationData] = await Promise.all([
@@ -235,14 +255,41 @@ export default function App() {
   };
 
   const loadAssets = async (nextFilters) => {
-    const data = await fetchAssets(nextFilters || filters);
-    setAssets(data);
+    const requestId = ++assetRequest.current;
+    const activeFilters = nextFilters || filters;
+    // Facets come from one slower aggregate query (each facet ignores its own
+    // filter), so the first page is shown without waiting for them.
+    fetchFacets(activeFilters)
+      .catch(() => null)
+      .then((facets) => {
+        if (requestId !== assetRequest.current) return;
+        setFormatOptions(facets ? facets.formats.map((item) => item.value).sort((a, b) => a.localeCompare(b)) : []);
+        setColorGroups(facets ? facets.colors : []);
+      });
+    const page = await fetchAssetPage(activeFilters);
+    if (requestId !== assetRequest.current) return;
+    setAssets(page.items);
+    setNextCursor(page.next_cursor || null);
     if (selected) {
-      const next = data.find((item) => item.id === selected.id);
+      const next = page.items.find((item) => item.id === selected.id);
       setSelected(next || null);
     }
   };
 
+  const loadMoreAssets = async () => {
+    if (!nextCursor || loadingMore.current) return;
+    loadingMore.current = true;
+    const requestId = assetRequest.current;
+    try {
+      const page = await fetchAssetPage(filters, nextCursor);
+      if (requestId !== assetRequest.current) return;
+      setAssets((prev) => [...prev, ...page.items]);
+      setNextCursor(page.next_cursor || null);
+    } finally {
+      loadingMore.current = false;
+    }
+  };
+
   const loadAnnotations = async (assetId) => {
     if (!assetId) {
       setAnnotations([]);
@@ -260,68 +307,29 @@ export default function App() {
     loadAssets();
   }, [filters]);
 
+  const hasProcessing = useMemo(() => assets.some((asset) => asset.status === "processing"), [assets]);
+
   useEffect(() => {
-    let active = true;
-    const buildFormats = (data) => {
-      const map = new Map();
-      data.forEach((asset) => {
-        const value = typeof asset.format === "string" ? asset.format.trim() : "";
-        if (!value) return;
-        const key = value.toLowerCase();
-        if (!map.has(key)) map.set(key, key);
-      });
-      return Array.from(map.values()).sort((a, b) => a.localeCompare(b));
-    };
-    const loadFormats = async () => {
+    if (!hasProcessing) return;
+    const timer = setInterval(async () => {
       try {
-        if (!filters.format) {
-          const next = buildFormats(assets);
-          if (active) setFormatOptions(next);
-          return;
+        const { counts } = await fetchJobs({ limit: 1 });
+        if (!counts.queued && !counts.running) {
+          clearInterval(timer);
+          await loadAssets();
+          await loadMeta();
         }
-        const nextFilters = { ...filters };
-        delete nextFilters.format;
-        const data = await fetchAssets(nextFilters);
-        if (!active) return;
-        setFormatOptions(buildFormats(data));
-      } catch (error) {
-        if (active) setFormatOptions([]);
+      } catch {
+        clearInterval(timer);
       }
-    };
-    loadFormats();
-    return () => {
-      active = false;
-    };
-  }, [filters, assets]);
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [hasProcessing, filters]);
 
   useEffect(() => {
     loadAnnotations(selected?.id);
   }, [selected?.id]);
 
-  useEffect(() => {
-    let active = true;
-    const loadColors = async () => {
-      try {
-        if (!filters.color) {
-          const next = buildColorGroups(assets);
-          if (active) setColorGroups(next);
-          return;
-        }
-        const nextFilters = { ...filters };
-        delete nextFilters.color;
-        const data = await fetchAssets(nextFilters);
-        if (!active) return;
-        setColorGroups(buildColorGroups(data));
-      } catch {
-        if (active) setColorGroups([]);
-      }
-    };
-    loadColors();
-    return () => {
-      active = false;
-    };
-  }, [filters, assets]);
-
   useEffect(() => {
     setViewerScale(1);
   }, [viewerAsset?.id]);
@@ -582,6 +590,15 @@ export default function App() {
     let uploadedBytes = 0;
     setUploadProgress({ active: true, percent: 0, current: files[0].name, index: 0, total: files.length });
     try {
+      // Create a dropped folder tree in one request instead of per uploaded file.
+      const folderPaths = new Set(
+        files
+          .filter((file) => file.relativePath && file.relativePath.includes("/"))
+          .map((file) => file.relativePath.slice(0, file.relativePath.lastIndexOf("/")))
+      );
+      if (folderPaths.size) {
+        await ensureFolders([...folderPaths]).catch(() => null);
+      }
       const concurrency = 3;
       let cursor = 0;
       const uploadOne = async (file, idx) => {
@@ -797,42 +814,6 @@ export default function App() {
   const currentThemeLabel =
     themeOptions.find((item) => item.value === displayThemeValue)?.label || "主题";
 
-  const parseHexColor = (value) => {
-    const normalized = String(value || "").trim().replace("#", "");
-    if (normalized.length !== 6) return null;
-    const r = parseInt(normalized.slice(0, 2), 16);
-    const g = parseInt(normalized.slice(2, 4), 16);
-    const b = parseInt(normalized.slice(4, 6), 16);
-    if ([r, g, b].some((v) => Number.isNaN(v))) return null;
-    return { r, g, b, hex: `#${normalized.toLowerCase()}` };
-  };
-
-  const colorDistance = (a, b) =>
-    Math.sqrt((a.r - b.r) ** 2 + (a.g - b.g) ** 2 + (a.b - b.b) ** 2);
-
-  const buildColorGroups = (data) => {
-    const groups = [];
-    const threshold = 28;
-    data.forEach((asset) => {
-      (asset.colors || []).forEach((color) => {
-        const rgb = parseHexColor(color);
-        if (!rgb) return;
-        const found = groups.find((group) => colorDistance(group, rgb) <= threshold);
-        if (!found) {
-          groups.push({ r: rgb.r, g: rgb.g, b: rgb.b, count: 1, hex: rgb.hex });
-          return;
-        }
-        found.count += 1;
-        found.r = Math.round((found.r * (found.count - 1) + rgb.r) / found.count);
-        found.g = Math.round((found.g * (found.count - 1) + rgb.g) / found.count);
-        found.b = Math.round((found.b * (found.count - 1) + rgb.b) / found.count);
-        const toHex = (n) => n.toString(16).padStart(2, "0");
-        found.hex = `#${toHex(found.r)}${toHex(found.g)}${toHex(found.b)}`;
-      });
-    });
-    return groups.sort((a, b) => b.count - a.count);
-  };
-
   const [recentColors, setRecentColors] = useState(() => {
     try {
       const raw = localStorage.getItem("recentColors");
@@ -864,8 +845,6 @@ export default function App() {
   const topColors = useMemo(() => filteredAllColors.slice(0, 15), [filteredAllColors]);
   const allColors = filteredAllColors;
 
-  const [formatOptions, setFormatOptions] = useState([]);
-
   const filteredFormats = useMemo(() => {
     if (!formatQuery) return formatOptions;
     const lower = formatQuery.toLowerCase();
@@ -874,11 +853,35 @@ export default function App() {
 
   const extraColors = Math.max(0, filteredAllColors.length - 15);
 
+  useEffect(() => {
+    if (!tagQuery) {
+      setTagSuggestions(null);
+      return undefined;
+    }
+    let active = true;
+    const timer = setTimeout(async () => {
+      try {
+        const data = await fetchTags({ prefix: tagQuery, limit: 50 });
+        if (active) setTagSuggestions(data);
+      } catch {
+        if (active) setTagSuggestions(null);
+      }
+    }, 150);
+    return () => {
+      active = false;
+      clearTimeout(timer);
+    };
+  }, [tagQuery]);
+
   const filteredTags = useMemo(() => {
     if (!tagQuery) return tags;
     const lower = tagQuery.toLowerCase();
-    return tags.filter((item) => item.name.toLowerCase().includes(lower));
-  }, [tagQuery, tags]);
+    const matches = tags.filter((item) => item.name.toLowerCase().includes(lower));
+    if (!tagSuggestions) return matches;
+    // Most-used prefix matches from the server first, then any other substring matches.
+    const suggested = new Set(tagSuggestions.map((item) => item.name));
+    return [...tagSuggestions, ...matches.filter((item) => !suggested.has(item.name))];
+  }, [tagQuery, tags, tagSuggestions]);
 
   const filteredDetailTags = useMemo(() => {
     if (!detailTagQuery) return tags;
@@ -911,6 +914,14 @@ export default function App() {
     const raw = Math.round(thumbHeight * ratio);
     return Math.min(maxWidth, Math.max(minWidth, raw));
   };
+  const thumbSrcSet = (asset) => {
+    if (!asset.thumb_url || !asset.thumb_medium_url) return undefined;
+    return (
+      `${mediaUrl(asset.thumb_url)} ${thumbWidth(asset, THUMB_SIZES.small)}w, ` +
+      `${mediaUrl(asset.thumb_medium_url)} ${thumbWidth(asset, THUMB_SIZES.medium)}w`
+    );
+  };
+
   const gridRef = useRef(null);
   const [gridColumns, setGridColumns] = useState(1);
 
@@ -928,6 +939,18 @@ export default function App() {
     return () => observer.disconnect();
   }, [gridWidth, assets.length]);
 
+  useEffect(() => {
+    if (!loadMoreRef.current || !nextCursor) return;
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) loadMoreAssets();
+      },
+      { rootMargin: "800px 0px" }
+    );
+    observer.observe(loadMoreRef.current);
+    return () => observer.disconnect();
+  }, [nextCursor, filters]);
+
   const highlightMatch = (text, query) => {
     if (!query) return text;
     const lower = text.toLowerCase();
@@ -1032,10 +1055,16 @@ export default function App() {
                 <li
                   key={folder.id}
                   className={activeFolder?.id === folder.id ? "active" : ""}
+                  title={`${folder.total_count} · ${formatSize(folder.total_bytes)}`}
                   onClick={() => {
                     setActiveFolder(folder);
                     setActiveSmart(null);
-                    setFilters({ ...form, tags: selectedTags.join(","), folder_id: folder.id });
+                    setFilters({
+                      ...form,
+                      tags: selectedTags.join(","),
+                      folder_id: folder.id,
+                      include_descendants: true
+                    });
                   }}
                 >
                   <span className="nav-icon">
@@ -1588,7 +1617,11 @@ export default function App() {
                   (asset.media_type === "raw" && asset.preview_url) ? (
                     <img
                       draggable={false}
-                      src={mediaUrl(asset.preview_url || asset.url)}
+                      src={mediaUrl(asset.thumb_url || asset.preview_url || asset.url)}
+                      srcSet={thumbSrcSet(asset)}
+                      sizes={`${cardWidthFor(asset)}px`}
+                      loading="lazy"
+                      decoding="async"
                       alt={asset.filename}
                       onError={(event) => {
                         event.currentTarget.style.display = "none";
@@ -1596,10 +1629,14 @@ export default function App() {
                       }}
                     />
                   ) : asset.media_type === "video" ? (
-                    asset.preview_url ? (
+                    asset.thumb_url || asset.preview_url ? (
                       <img
                         draggable={false}
-                        src={mediaUrl(asset.preview_url)}
+                        src={mediaUrl(asset.thumb_url || asset.preview_url)}
+                        srcSet={thumbSrcSet(asset)}
+                        sizes={`${cardWidthFor(asset)}px`}
+                        loading="lazy"
+                        decoding="async"
                         alt={asset.filename}
                         onError={(event) => {
                           event.currentTarget.style.display = "none";
@@ -1638,6 +1675,7 @@ export default function App() {
                 </div>
               </article>
             ))}
+            {nextCursor ? <div ref={loadMoreRef} className="grid-sentinel" aria-hidden="true" /> : null}
           </div>
         </section>
       </main>
@@ -1828,9 +1866,16 @@ export default function App() {
             <div className="field colors">
               <label>颜色</label>
               <div className="swatches">
-                {selected.colors.map((color) => (
-                  <span key={color} style={{ background: color }} title={color} />
-                ))}
+                {selected.colors.map((color, index) => {
+                  const coverage = selected.color_coverage?.[index];
+                  return (
+                    <span
+                      key={color}
+                      style={{ background: color }}
+                      title={coverage ? `${color} · ${Math.round(coverage * 100)}%` : color}
+                    />
+                  );
+                })}
               </div>
             </div>
             <div className="detail-actions">
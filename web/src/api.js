@@ -1,6 +1,17 @@
 ﻿export const API_BASE = import.meta.env.VITE_API_BASE || "/api";
 const MEDIA_BASE = import.meta.env.VITE_MEDIA_BASE || API_BASE;
 
+export async function fetchFacets(params = {}) {
+  const qs = new URLSearchParams();
+  Object.entries(params).forEach(([key, value]) => {
+    if (value === undefined || value === null || value === "") return;
+    qs.set(key, value);
+  });
+  const res = await fetch(`${API_BASE}/assets/facets?${qs.toString()}`);
+  if (!res.ok) throw new Error("加载筛选项失败");
+  return res.json();
+}
+
 export async function fetchAssets(params = {}) {
   const qs = new URLSearchParams();
   Object.entries(params).forEach(([key, value]) => {
@@ -12,6 +23,55 @@ export async function fetchAssets(params = {}) {
   return res.json();
 }
 
+// Only what the grid and detail panel read; fetched column-wise to skip
+// repeating every key name for every asset.
+const PAGE_FIELDS = [
+  "id",
+  "filename",
+  "media_type",
+  "format",
+  "width",
+  "height",
+  "size_bytes",
+  "tags",
+  "colors",
+  "color_coverage",
+  "status",
+  "note",
+  "folder_id",
+  "url",
+  "preview_url",
+  "thumb_url",
+  "thumb_medium_url"
+];
+
+function rowsFromColumns(columns, count) {
+  const names = Object.keys(columns);
+  const items = new Array(count);
+  for (let index = 0; index < count; index += 1) {
+    const item = {};
+    for (const name of names) item[name] = columns[name][index];
+    items[index] = item;
+  }
+  return items;
+}
+
+export async function fetchAssetPage(params = {}, cursor = null, limit = 200) {
+  const qs = new URLSearchParams();
+  Object.entries(params).forEach(([key, value]) => {
+    if (value === undefined || value === null || value === "") return;
+    qs.set(key, value);
+  });
+  qs.set("limit", limit);
+  qs.set("fields", PAGE_FIELDS.join(","));
+  qs.set("columnar", "true");
+  if (cursor) qs.set("cursor", cursor);
+  const res = await fetch(`${API_BASE}/assets?${qs.toString()}`);
+  if (!res.ok) throw new Error("加载素材失败");
+  const data = await res.json();
+  return { items: rowsFromColumns(data.columns, data.count), next_cursor: data.next_cursor };
+}
+
 export async function uploadAsset(file, meta = {}) {
   const form = new FormData();
   form.append("file", file);
@@ -23,7 +83,100 @@ export async function uploadAsset(file, meta = {}) {
   return res.json();
 }
 
+const RESUMABLE_THRESHOLD = 64 * 1024 * 1024;
+const RESUMABLE_PARALLEL = 3;
+const RESUMABLE_RETRIES = 3;
+
+async function putChunk(uploadId, offset, blob) {
+  let lastError = null;
+  for (let attempt = 0; attempt < RESUMABLE_RETRIES; attempt += 1) {
+    try {
+      // eslint-disable-next-line no-await-in-loop
+      const res = await fetch(`${API_BASE}/uploads/${uploadId}?offset=${offset}`, {
+        method: "PUT",
+        headers: { "Content-Type": "application/octet-stream" },
+        body: blob
+      });
+      if (res.ok) return;
+      lastError = new Error("上传失败");
+    } catch (err) {
+      lastError = err;
+    }
+  }
+  throw lastError;
+}
+
+export async function uploadAssetResumable(file, meta = {}, onProgress, onError) {
+  const relativePath = file.relativePath && file.relativePath.includes("/") ? file.relativePath : null;
+  const key = `upload:${relativePath || file.name}:${file.size}:${file.lastModified}`;
+  try {
+    let session = null;
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+      const res = await fetch(`${API_BASE}/uploads/${savedId}`);
+      if (res.ok) session = await res.json();
+    }
+    if (!session) {
+      const res = await fetch(`${API_BASE}/uploads`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          filename: file.name,
+          size: file.size,
+          mime: file.type || null,
+          folder_id: meta.folder_id || null,
+          relative_path: relativePath,
+          tags: meta.tags || null,
+          note: meta.note || null
+        })
+      });
+      if (!res.ok) throw new Error("上传失败");
+      session = await res.json();
+      localStorage.setItem(key, session.id);
+    }
+
+    const chunkSize = session.chunk_size;
+    const received = new Set(session.received);
+    const pending = [];
+    let loaded = 0;
+    for (let index = 0; index < session.chunks; index += 1) {
+      const length = Math.min(chunkSize, file.size - index * chunkSize);
+      if (received.has(index)) loaded += length;
+      else pending.push(index);
+    }
+    const report = () => {
+      if (onProgress) onProgress({ lengthComputable: true, loaded, total: file.size });
+    };
+    report();
+
+    const workers = Array.from({ length: RESUMABLE_PARALLEL }).map(async () => {
+      while (pending.length) {
+        const index = pending.shift();
+        const offset = index * chunkSize;
+        const blob = file.slice(offset, Math.min(offset + chunkSize, file.size));
+        // eslint-disable-next-line no-await-in-loop
+        await putChunk(session.id, offset, blob);
+        loaded += blob.size;
+        report();
+      }
+    });
+    await Promise.all(workers);
+
+    const res = await fetch(`${API_BASE}/uploads/${session.id}/complete`, { method: "POST" });
+    if (!res.ok) throw new Error("上传失败");
+    localStorage.removeItem(key);
+    return res.json();
+  } catch (err) {
+    const error = err instanceof Error ? err : new Error("上传失败");
+    if (onError) onError(error);
+    throw error;
+  }
+}
+
 export function uploadAssetWithProgress(file, meta = {}, onProgress, onError) {
+  if (file.size >= RESUMABLE_THRESHOLD) {
+    return uploadAssetResumable(file, meta, onProgress, onError);
+  }
   return new Promise((resolve, reject) => {
     const form = new FormData();
     form.append("file", file);
@@ -93,6 +246,16 @@ export async function createFolder(payload) {
   return res.json();
 }
 
+export async function ensureFolders(paths) {
+  const res = await fetch(`${API_BASE}/folders/ensure`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ paths })
+  });
+  if (!res.ok) throw new Error("创建文件夹失败");
+  return res.json();
+}
+
 export async function deleteFolder(id) {
   const res = await fetch(`${API_BASE}/folders/${id}`, { method: "DELETE" });
   if (!res.ok) {
@@ -102,12 +265,20 @@ export async function deleteFolder(id) {
   return res.json();
 }
 
-export async function fetchTags() {
-  const res = await fetch(`${API_BASE}/tags`);
+export async function fetchTags(params = {}) {
+  const qs = new URLSearchParams(params);
+  const res = await fetch(`${API_BASE}/tags?${qs.toString()}`);
   if (!res.ok) throw new Error("加载标签失败");
   return res.json();
 }
 
+export async function fetchJobs(params = {}) {
+  const qs = new URLSearchParams(params);
+  const res = await fetch(`${API_BASE}/jobs?${qs.toString()}`);
+  if (!res.ok) throw new Error("加载任务失败");
+  return res.json();
+}
+
 export async function fetchSmartFolders() {
   const res = await fetch(`${API_BASE}/smart-folders`);
   if (!res.ok) throw new Error("加载智能文件夹失败");